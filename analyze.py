@@ -1,10 +1,19 @@
-import re
+import os
 import json
+import hashlib
+import threading
+
+from collections import Counter
+from dataclasses import dataclass
+from functools import cached_property
+from types import MappingProxyType
 
-import pandas as pd
 import numpy as np
 
-from sklearn.cluster import DBSCAN
+from scipy import sparse
+
+from lsh import MinHashIndex
+from metrics import stage
 
 
 MASTER_JSON_FILE = "json_data/cedh_decklists.json"
@@ -13,6 +22,35 @@ NORM_MASTER_JSON_FILE = "json_data/normalized_decklists.json"
 SCRYFALL_DICTIONARY = "json_data/scryfall_card_dictionary.json"
 LITE_SCRYFALL_DICT = "json_data/lite_scryfall_dict.json"
 
+SNAPSHOT_BINARY = "json_data/ddb_snapshot.bin"
+BINARY_MAGIC = b"DDBSNAP\0"
+BINARY_FORMAT = 2
+
+COLORS = "WUBRG"
+
+# Archetype clustering: maximum Jaccard distance between neighboring decks
+# and minimum number of decks forming a cluster core
+CLUSTER_EPS = 0.35
+CLUSTER_MIN_DECKS = 3
+
+# Decks compared against all others at once when computing distances
+DISTANCE_BLOCK = 512
+
+# MinHash hash functions and LSH bands for approximate nearest decks
+LSH_PERMUTATIONS = 192
+LSH_BANDS = 64
+
+CARD_TYPES = [
+    "Land",
+    "Creature",
+    "Artifact",
+    "Enchantment",
+    "Instant",
+    "Sorcery",
+    "Planeswalker",
+    "Legendary"
+]
+
 BASIC_LANDS = [
     "plains",
     "island",
@@ -27,6 +65,16 @@ BASIC_LANDS = [
     "snow covered forest"
 ]
 
+NORMALIZE_TABLE = str.maketrans({
+    "-": " ",
+    **{c: None for c in "!'\"()&,./:?_®"},
+    **{c: "a" for c in "àáâ"},
+    "é": "e",
+    "í": "i",
+    "ö": "o",
+    **{c: "u" for c in "úû"}
+})
+
 
 def load_database():
     """
@@ -72,6 +120,397 @@ def load_scryfall(filename=SCRYFALL_DICTIONARY):
     return scryfall_dict
 
 
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Immutable, process-wide view of the ddb and the card metadata.
+    Built once per worker and shared by every request. Array fields may
+    be read-only views into the memory-mapped binary snapshot, while the
+    dict views of the json files are only parsed when first accessed
+    """
+
+    version: str
+    num_decks: int
+    card_names: tuple
+    card_ids: MappingProxyType
+    raw_names: tuple
+    full_names: tuple
+    deck_names: tuple
+    deck_ids: MappingProxyType
+    deck_colors: tuple
+    deck_types: tuple
+    incidence: sparse.csr_matrix
+    copies: sparse.csr_matrix
+    card_counts: np.ndarray
+    nonbasic: np.ndarray
+    deck_sizes: np.ndarray
+    card_masks: np.ndarray
+    deck_masks: np.ndarray
+    inclusion: np.ndarray
+    card_types: np.ndarray
+    card_cmc: np.ndarray
+    deck_clusters: np.ndarray
+    medoids: np.ndarray
+
+    @cached_property
+    def scryfall(self):
+        return MappingProxyType(load_lite())
+
+    @cached_property
+    def dataset(self):
+        return MappingProxyType(load_database())
+
+    @cached_property
+    def flat_dataset(self):
+        return MappingProxyType(load_normalized())
+
+    @cached_property
+    def raw_flat_dataset(self):
+        return MappingProxyType(flatten(self.dataset))
+
+    @cached_property
+    def raw_all_cards(self):
+        return MappingProxyType(summary(self.dataset)[0])
+
+    @cached_property
+    def all_cards(self):
+        return MappingProxyType(
+            dict(zip(self.card_names, self.card_counts.tolist()))
+        )
+
+    @cached_property
+    def cooccurrence(self):
+        incidence = self.incidence.astype(np.int32)
+        cooccurrence = (incidence.T @ incidence).tocsr()
+        cooccurrence.data = read_only(cooccurrence.data)
+        return cooccurrence
+
+    @cached_property
+    def minhash(self):
+        nonbasic = sparse.csr_matrix(self.incidence.multiply(self.nonbasic))
+        nonbasic.eliminate_zeros()
+        return MinHashIndex(nonbasic, LSH_PERMUTATIONS, LSH_BANDS)
+
+    @cached_property
+    def generality_distribution(self):
+        return generality_table(self)
+
+    @cached_property
+    def core_counts(self):
+        return MappingProxyType(core_table(self.dataset))
+
+    @cached_property
+    def deck_bitsets(self):
+        columns = np.packbits(
+            self.incidence.T.toarray().astype(bool), axis=1, bitorder="little"
+        )
+        return tuple(
+            int.from_bytes(row.tobytes(), "little") for row in columns
+        )
+
+    @cached_property
+    def ddb_color_rep(self):
+        return MappingProxyType(dict(Counter(self.deck_colors)))
+
+    @cached_property
+    def deck_ci(self):
+        return MappingProxyType(db_ci_info(self.dataset))
+
+
+# Lazily built snapshot tables that request handlers read
+WARM_TABLES = [
+    "generality_distribution", "core_counts", "deck_bitsets", "cooccurrence"
+]
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def dataset_version(filenames=(
+    MASTER_JSON_FILE, NORM_MASTER_JSON_FILE, LITE_SCRYFALL_DICT
+)):
+    """
+    Computes short content hash of the json files backing a snapshot
+    """
+
+    digest = hashlib.sha1()
+
+    for filename in filenames:
+        with open(filename, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+
+def compile_snapshot(version=None):
+    """
+    Compiles json files into the string tables and flat arrays
+    backing a snapshot
+    """
+
+    with stage("load_json"):
+        dataset = load_database()
+        flat_dataset = load_normalized()
+        scryfall = load_lite()
+
+    all_cards, _ = dataset_summary(flat_dataset)
+
+    card_names = list(all_cards)
+    card_ids = card_vocabulary(card_names)
+    deck_names = sorted(flat_dataset)
+    raw_names = {}
+    deck_colors = {}
+    deck_types = {}
+
+    for color in dataset:
+        for deck_type in dataset[color]:
+            for deck in dataset[color][deck_type]:
+                deck_colors[deck] = color
+                deck_types[deck] = deck_type
+                for card in dataset[color][deck_type][deck]:
+                    raw_names.setdefault(normalize(card), card)
+
+    with stage("incidence"):
+        copies = create_incidence(
+            flat_dataset, deck_names, card_ids, counts=True
+        )
+
+    nonbasic = np.array([not_basic_land(card) for card in card_names])
+    deck_sizes = (copies > 0) @ nonbasic.astype(np.int32)
+
+    with stage("cluster"):
+        deck_clusters, medoids = cluster_decks(
+            sparse.csr_matrix((copies > 0).multiply(nonbasic), dtype=np.int32),
+            deck_sizes
+        )
+    deck_masks = np.array([
+        color_mask(deck_colors[deck]) for deck in deck_names
+    ], dtype=np.uint8)
+
+    header = {
+        "version": version or dataset_version(),
+        "strings": {
+            "card_names": card_names,
+            "raw_names": [
+                raw_names.get(card, scryfall[card]["full_name"])
+                for card in card_names
+            ],
+            "full_names": [scryfall[c]["full_name"] for c in card_names],
+            "deck_names": deck_names,
+            "deck_colors": [deck_colors[deck] for deck in deck_names],
+            "deck_types": [deck_types[deck] for deck in deck_names]
+        }
+    }
+
+    arrays = {
+        "indptr": copies.indptr,
+        "indices": copies.indices,
+        "copies": copies.data,
+        "card_counts": np.array(
+            [all_cards[c] for c in card_names], dtype=np.int32
+        ),
+        "nonbasic": nonbasic,
+        "deck_sizes": deck_sizes,
+        "card_masks": np.array([
+            color_mask(scryfall[c]["color_identity"]) for c in card_names
+        ], dtype=np.uint8),
+        "deck_masks": deck_masks,
+        "inclusion": inclusion_table(deck_masks),
+        "card_types": np.array([
+            type_flags(scryfall[c]["type_line"]) for c in card_names
+        ], dtype=np.uint8),
+        "card_cmc": np.array(
+            [scryfall[c]["cmc"] for c in card_names], dtype=np.float32
+        ),
+        "deck_clusters": deck_clusters,
+        "medoids": medoids
+    }
+
+    return header, arrays
+
+
+def snapshot_from_arrays(header, arrays):
+    """
+    Wraps compiled string tables and arrays into a snapshot without
+    copying array data
+    """
+
+    strings = header["strings"]
+    card_names = tuple(strings["card_names"])
+    deck_names = tuple(strings["deck_names"])
+    arrays = {name: read_only(arrays[name]) for name in arrays}
+
+    shape = (len(deck_names), len(card_names))
+    indices, indptr = arrays["indices"], arrays["indptr"]
+    ones = read_only(np.ones(len(indices), dtype=np.uint8))
+
+    return Snapshot(
+        version=header["version"],
+        num_decks=len(deck_names),
+        card_names=card_names,
+        card_ids=MappingProxyType(card_vocabulary(card_names)),
+        raw_names=tuple(strings["raw_names"]),
+        full_names=tuple(strings["full_names"]),
+        deck_names=deck_names,
+        deck_ids=MappingProxyType(card_vocabulary(deck_names)),
+        deck_colors=tuple(strings["deck_colors"]),
+        deck_types=tuple(strings["deck_types"]),
+        incidence=sparse.csr_matrix((ones, indices, indptr), shape=shape),
+        copies=sparse.csr_matrix(
+            (arrays["copies"], indices, indptr),
+            shape=shape
+        ),
+        card_counts=arrays["card_counts"],
+        nonbasic=arrays["nonbasic"],
+        deck_sizes=arrays["deck_sizes"],
+        card_masks=arrays["card_masks"],
+        deck_masks=arrays["deck_masks"],
+        inclusion=arrays["inclusion"],
+        card_types=arrays["card_types"],
+        card_cmc=arrays["card_cmc"],
+        deck_clusters=arrays["deck_clusters"],
+        medoids=arrays["medoids"]
+    )
+
+
+def write_binary(header, arrays, filename=SNAPSHOT_BINARY):
+    """
+    Writes compiled snapshot as a single binary file: magic bytes,
+    json header length and header, then 64 byte aligned raw arrays.
+    The file is replaced by rename, so processes that have the old
+    file mapped keep reading the old data
+    """
+
+    offset = 0
+    layout = {}
+
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset
+        }
+        offset += -(-array.nbytes // 64) * 64
+
+    header = dict(header, format=BINARY_FORMAT, arrays=layout)
+    encoded = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(BINARY_MAGIC) + 8 + len(encoded)) // 64) * 64
+
+    tmp_filename = f"{filename}.tmp"
+
+    with open(tmp_filename, "wb") as f:
+        f.write(BINARY_MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(array.tobytes())
+
+        f.truncate(data_start + offset)
+
+    os.replace(tmp_filename, filename)
+
+
+def load_binary(filename=SNAPSHOT_BINARY):
+    """
+    Memory-maps binary snapshot read-only. Returns header and arrays,
+    or None if file has an unknown format or its arrays do not fit in
+    it, as with a truncated file
+    """
+
+    with open(filename, "rb") as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            return None
+        size = int.from_bytes(f.read(8), "little")
+        try:
+            header = json.loads(f.read(size).decode("utf-8"))
+        except ValueError:
+            return None
+
+    if not isinstance(header, dict) or header.get("format") != BINARY_FORMAT:
+        return None
+
+    data_start = -(-(len(BINARY_MAGIC) + 8 + size) // 64) * 64
+    buffer = np.memmap(filename, dtype=np.uint8, mode="r")
+    arrays = {}
+
+    try:
+        for name, layout in header["arrays"].items():
+            dtype = np.dtype(layout["dtype"])
+            count = int(np.prod(layout["shape"]))
+            start = data_start + layout["offset"]
+            end = start + count * dtype.itemsize
+            if start < data_start or end > len(buffer):
+                return None
+            arrays[name] = (
+                buffer[start:end].view(dtype).reshape(layout["shape"])
+            )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    return header, arrays
+
+
+def build_snapshot():
+    """
+    Builds snapshot from the binary file if it matches the current json
+    files, otherwise compiles it from the json files directly
+    """
+
+    version = dataset_version()
+
+    try:
+        with stage("load_binary"):
+            compiled = load_binary()
+    except FileNotFoundError:
+        compiled = None
+
+    if compiled is None or compiled[0].get("version") != version:
+        compiled = compile_snapshot(version)
+
+    return snapshot_from_arrays(*compiled)
+
+
+def read_only(array):
+    """
+    Marks numpy array as immutable so snapshot data cannot be altered
+    """
+
+    array.flags.writeable = False
+
+    return array
+
+
+def get_snapshot():
+    """
+    Returns the process-wide snapshot, building it on first access
+    """
+
+    global _snapshot
+
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = build_snapshot()
+
+    return _snapshot
+
+
+def warm_snapshot(snapshot):
+    """
+    Builds the lazily built tables request handlers read, so that no
+    request pays for them and forked workers share them
+    """
+
+    for table in WARM_TABLES:
+        getattr(snapshot, table)
+
+    return snapshot
+
+
 def flatten(data):
     """
     Flattens database master json file for easier access
@@ -92,16 +531,7 @@ def normalize(card_name):
     Transforms card name into lower case without special characters
     """
 
-    card_name = card_name.lower().replace("-", " ")
-
-    card_name = re.sub(r"[\!\'\"\(\)\&\,\.\/\:\?\_\®]", "", card_name)
-    card_name = re.sub(r"[àáâ]", "a", card_name)
-    card_name = re.sub(r"[é]", "e", card_name)
-    card_name = re.sub(r"[í]", "i", card_name)
-    card_name = re.sub(r"[ö]", "o", card_name)
-    card_name = re.sub(r"[úû]", "u", card_name)
-
-    return card_name
+    return card_name.lower().translate(NORMALIZE_TABLE)
 
 
 def find_decklist(dataset, target_name):
@@ -167,22 +597,75 @@ def deck_rep_by_color(dataset):
     return color_rep
 
 
+def color_mask(colors):
+    """
+    Encodes color identity (color code string or list of colors)
+    as 5 bit WUBRG mask
+    """
+
+    if colors == "Colorless":
+        return 0
+
+    colors = [c.upper() for c in colors]
+
+    return sum(1 << i for i, c in enumerate(COLORS) if c in colors)
+
+
+def type_flags(type_line):
+    """
+    Encodes card type line as bit flags following CARD_TYPES
+    """
+
+    return sum(1 << i for i, t in enumerate(CARD_TYPES) if t in type_line)
+
+
+def has_type(snapshot, card_type):
+    """
+    Returns boolean array over the snapshot card vocabulary marking
+    cards of given type
+    """
+
+    return (snapshot.card_types >> CARD_TYPES.index(card_type)) & 1 == 1
+
+
+def inclusion_table(deck_masks):
+    """
+    Constructs 32 entry table holding, for every color mask, the number
+    of decks whose color identity contains that mask
+    """
+
+    deck_counts = np.bincount(deck_masks, minlength=32)
+    table = np.zeros(32, dtype=np.int64)
+
+    for mask in range(32):
+        for deck_mask in range(32):
+            if deck_mask & mask == mask:
+                table[mask] += deck_counts[deck_mask]
+
+    return table
+
+
 def max_inclusion_value(card, ddb_color_rep, scryfall_dict):
     """
     Computes the total number of possible decks which are
     able to include a given card based on color identity
     """
 
-    card_identity = scryfall_dict[card]["color_identity"]
+    card_mask = color_mask(scryfall_dict[card]["color_identity"])
+
+    return sum(
+        ddb_color_rep[color_combo] for color_combo in ddb_color_rep
+        if color_mask(color_combo) & card_mask == card_mask
+    )
 
-    max_inclusion = 0
-    colorless = not card_identity
 
-    for color_combo in ddb_color_rep:
-        if all(c in color_combo.upper() for c in card_identity) or colorless:
-            max_inclusion += ddb_color_rep[color_combo]
+def inclusion_values(snapshot):
+    """
+    Looks up maximum inclusion value of every card in the snapshot
+    vocabulary from the color identity table
+    """
 
-    return max_inclusion
+    return snapshot.inclusion[snapshot.card_masks]
 
 
 def deck_identity(decklist, scryfall_dict):
@@ -205,9 +688,20 @@ def ci_filter(ci, scryfall_dict):
     provided color identity
     """
 
-    def sc(x): return scryfall_dict[x]["color_identity"]
+    ci_mask = color_mask(ci)
+
+    def sc(x): return color_mask(scryfall_dict[x]["color_identity"])
 
-    return lambda x: not sc(x) or all(c in ci for c in sc(x))
+    return lambda x: not sc(x) & ~ci_mask
+
+
+def ci_mask_filter(snapshot, ci):
+    """
+    Returns boolean array over the snapshot card vocabulary marking
+    cards legal in provided color identity
+    """
+
+    return (snapshot.card_masks & ~np.uint8(color_mask(ci))) == 0
 
 
 def decklist_filter(decklist):
@@ -336,6 +830,8 @@ def old_create_dataframe(dataset, all_cards):
     Creates dataframe snapshot of ddb - DEPRECATED
     """
 
+    import pandas as pd
+
     all_cards_x = list(filter(not_basic_land, all_cards.keys()))
     dataset_flat = {}
 
@@ -364,9 +860,11 @@ def old_create_dataframe(dataset, all_cards):
 
 def create_dataframe(flat_dataset, all_cards):
     """
-    Creates dataframe snapshot of ddb
+    Creates dense dataframe snapshot of ddb - DEPRECATED, see create_incidence
     """
 
+    import pandas as pd
+
     all_cards_x = list(filter(not_basic_land, all_cards))
     deck_names = list(sorted(flat_dataset))
     all_cards_dict = {card: i for i, card in enumerate(all_cards_x)}
@@ -386,36 +884,141 @@ def create_dataframe(flat_dataset, all_cards):
     )
 
 
-def df_similarity(df, a, b):
-    v = df.loc[a].values
-    w = df.loc[b].values
+def card_vocabulary(names):
+    """
+    Interns names into contiguous integer ids
+    """
 
-    return sum(v & w) / sum(v | w)
+    return {name: i for i, name in enumerate(names)}
 
 
-def similarity(df, decklist_vec, b, output=False):
+def create_incidence(flat_dataset, deck_names, card_ids, counts=False):
+    """
+    Creates sparse deck x card incidence matrix of ddb. Row i marks
+    every distinct card of deck_names[i] with a one, or with its
+    number of copies if counts is set
+    """
+
+    indptr = [0]
+    indices = []
+    data = []
+
+    for deck in deck_names:
+        copies = Counter(card_ids[card] for card in flat_dataset[deck])
+
+        for card_id in sorted(copies):
+            indices.append(card_id)
+            data.append(copies[card_id] if counts else 1)
+
+        indptr.append(len(indices))
+
+    return sparse.csr_matrix(
+        (
+            np.array(data, dtype=np.uint8),
+            np.array(indices, dtype=np.int32),
+            np.array(indptr, dtype=np.int32)
+        ),
+        shape=(len(deck_names), len(card_ids))
+    )
+
+
+def df_similarity(snapshot, a, b):
+    """
+    Computes similarity between two ddb decks. Ignores basic lands
+    """
+
+    v = deck2vec(snapshot, snapshot.flat_dataset[a])
+
+    return similarity(snapshot, v, b)
+
+
+def similarity(snapshot, decklist_vec, b, output=False):
     """
     Computes similarity between given decklist and given ddb deck
     """
 
-    v = df.loc[b].values
+    i = snapshot.deck_ids[b]
+    row = snapshot.incidence[i]
 
-    result = sum(decklist_vec & v) / sum(decklist_vec | v)
+    common = int(row.dot(decklist_vec)[0])
+    union = int(decklist_vec.sum()) + int(snapshot.deck_sizes[i]) - common
+    result = common / union
 
     if output:
         print(f"Comparing deck to {b}")
-        print(f"{sum(decklist_vec & v)} card(s) in common")
+        print(f"{common} card(s) in common")
         print(f"Jaccard similarity: {result}")
 
     return result
 
 
-def deck2vec(df, decklist):
+def overlap_sizes(snapshot, decklist_vec, decks=None):
+    """
+    Computes intersection and union sizes of given decklist against
+    every ddb deck, or only given deck ids, with a single sparse
+    matrix-vector product
+    """
+
+    incidence, deck_sizes = snapshot.incidence, snapshot.deck_sizes
+
+    if decks is not None:
+        incidence, deck_sizes = incidence[decks], deck_sizes[decks]
+
+    common = incidence @ decklist_vec
+    union = int(decklist_vec.sum()) + deck_sizes - common
+
+    return common, union
+
+
+def similarities(snapshot, decklist_vec, decks=None):
+    """
+    Computes similarity between given decklist and all ddb decks,
+    ordered like snapshot.deck_names, or only given deck ids
+    """
+
+    common, union = overlap_sizes(snapshot, decklist_vec, decks)
+
+    return common / union
+
+
+def card_scores(snapshot, scores, decks=None):
     """
-    Transforms given decklist to vector form based on ddb
+    Computes geometric mean of deck similarity scores for every card,
+    weighted by the number of copies each deck plays. Averaging logs
+    keeps popular cards from underflowing to zero. With given deck ids
+    only those decks are averaged and cards outside them score zero
     """
 
-    return pd.Series([1 if card in decklist else 0 for card in df.columns])
+    with np.errstate(divide="ignore"):
+        log_scores = np.log(scores)
+
+    if decks is None:
+        log_sums = snapshot.copies.T @ log_scores
+        return np.exp(log_sums / snapshot.card_counts)
+
+    copies = snapshot.copies[decks]
+    card_counts = np.asarray(copies.sum(axis=0)).ravel()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = np.exp((copies.T @ log_scores) / card_counts)
+
+    result[card_counts == 0] = 0
+
+    return result
+
+
+def deck2vec(snapshot, decklist):
+    """
+    Transforms given decklist to binary vector over the ddb card
+    vocabulary. Cards outside the ddb and basic lands are dropped
+    """
+
+    vec = np.zeros(len(snapshot.card_names), dtype=np.int32)
+    ids = [snapshot.card_ids[c] for c in decklist if c in snapshot.card_ids]
+    vec[ids] = 1
+    vec[~snapshot.nonbasic] = 0
+
+    return vec
 
 
 def cards_in_common_ratio(decklist_1, decklist_2):
@@ -426,122 +1029,340 @@ def cards_in_common_ratio(decklist_1, decklist_2):
     return len([a for a in decklist_1 if a in decklist_2]) / 100
 
 
-def deck_similarities(decklist, deck_color_identity):
+def nearest_decks(snapshot, decklist, k=50, approximate=False):
+    """
+    Returns ids and similarities of the k ddb decks most similar to
+    given decklist. The approximate search only ranks decks found
+    through the MinHash index, so it may miss some of them
+    """
+
+    decklist_vec = deck2vec(snapshot, decklist)
+
+    if approximate:
+        return snapshot.minhash.nearest(decklist_vec, k)
+
+    scores = similarities(snapshot, decklist_vec)
+    ids = np.argsort(-scores, kind="stable")[:k]
+
+    return ids, scores[ids]
+
+
+def deck_similarities(decklist, deck_color_identity, approximate=False):
     """
     Displays top 50 ddb decks based on similarity to given decklist
     """
 
-    dataset = load_database()
-    flat_dataset = flatten(dataset)
-    all_cards, num_decks = summary(dataset)
-    df = create_dataframe(dataset, all_cards)
-    decklist_vec = deck2vec(df, decklist)
+    snapshot = get_snapshot()
+    flat_dataset = snapshot.flat_dataset
+    ids, scores = nearest_decks(snapshot, decklist, 50, approximate)
 
-    for deck in sorted(
-        dataset,
-        key=lambda x: similarity(df, decklist_vec, x),
-        reverse=True
-    )[:50]:
-        print(f"Value: {similarity(df, decklist_vec, deck):.3f}, "
+    for i, score in zip(ids, scores):
+        deck = snapshot.deck_names[i]
+        print(f"Value: {score:.3f}, "
               f"{cards_in_common_ratio(decklist, flat_dataset[deck])}, {deck}")
 
 
-def recommend(decklist, deck_color_identity, excludelist, land_mode=False):
+def block_distances(incidence, deck_sizes, start, rows=None):
     """
-    Recommends cards for a given decklist based on ddb data
+    Computes dense Jaccard distances from a block of DISTANCE_BLOCK
+    rows, starting at given row, to all rows of a binary incidence
+    matrix, or to the rows with given ids
     """
 
-    s = load_lite()
-    flat_dataset = load_normalized()
-    all_cards, num_decks = dataset_summary(flat_dataset)
+    if rows is not None:
+        incidence, deck_sizes = incidence[rows], deck_sizes[rows]
 
-    # TODO:
-    # ADD DDB_COLOR_REP TO MASTER JSON SO LOADING DATASET IS NOT NEEDED
-    dataset = load_database()
-    ddb_color_rep = deck_rep_by_color(dataset)
+    block = slice(start, start + DISTANCE_BLOCK)
+    common = (incidence[block] @ incidence.T).toarray()
+    union = deck_sizes[block, np.newaxis] + deck_sizes[np.newaxis, :] - common
 
-    df = create_dataframe(flat_dataset, all_cards)
-    decklist_vec = deck2vec(df, decklist)
+    return 1 - common / union
 
-    master = {}
-    for deck in flat_dataset:
-        cur_filtered = filter(lambda x: x not in decklist, flat_dataset[deck])
-        cur_score = similarity(df, decklist_vec, deck)
 
-        for card in cur_filtered:
-            if card not in master:
-                master[card] = []
+def jaccard_distances(incidence, deck_sizes, max_distance=1.0):
+    """
+    Computes sparse Jaccard distance matrix between rows of a binary
+    incidence matrix, keeping only pairs within max_distance. Zero
+    distances, including the diagonal, are stored explicitly. Rows are
+    compared a block at a time, so memory stays bounded by the pairs
+    kept
+    """
 
-            master[card].append(cur_score)
+    num_rows = incidence.shape[0]
+    rows, cols, data = [], [], []
 
-    def measure(x): return np.power(np.prod(master[x]), 1 / len(master[x]))
-    def mi_val(x): return max_inclusion_value(x, ddb_color_rep, s)
-    def mi_ratio(x): return max_inc_ratio(x, all_cards, ddb_color_rep, s)
-    def rep_ratio(x): return all_cards[x] / num_decks
-    def composite(x): return (0.5 * mi_ratio(x) + 0.5 * rep_ratio(x))
+    for start in range(0, num_rows, DISTANCE_BLOCK):
+        distances = block_distances(incidence, deck_sizes, start)
+        row, col = np.nonzero(distances <= max_distance)
+        rows.append(row + start)
+        cols.append(col)
+        data.append(distances[row, col])
 
-    cif = ci_filter(deck_color_identity, s)
-    def lf(x): return "Land" in s[x]["type_line"]
+    return sparse.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(num_rows, num_rows)
+    )
+
+
+def medoid(incidence, deck_sizes, members):
+    """
+    Returns the member deck with the smallest total Jaccard distance to
+    all other members
+    """
+
+    totals = np.concatenate([
+        block_distances(incidence, deck_sizes, start, members).sum(axis=1)
+        for start in range(0, len(members), DISTANCE_BLOCK)
+    ])
+
+    return members[np.argmin(totals)]
+
+
+def cluster_decks(incidence, deck_sizes, eps=CLUSTER_EPS,
+                  min_samples=CLUSTER_MIN_DECKS):
+    """
+    Clusters decks into archetypes with DBSCAN over sparse Jaccard
+    distances and finds the medoid of every cluster. Decks outside any
+    cluster core join the cluster of their nearest medoid. Returns
+    cluster of every deck and deck id of every cluster medoid
+    """
+
+    # Only needed when compiling a snapshot, so workers loading the
+    # binary file never import scikit-learn
+    from sklearn.cluster import DBSCAN
+
+    distances = jaccard_distances(incidence, deck_sizes, eps)
+    labels = DBSCAN(
+        eps=eps, min_samples=min_samples, metric="precomputed"
+    ).fit_predict(distances)
+
+    if labels.max() < 0:
+        labels[:] = 0
+
+    medoids = np.array([
+        medoid(incidence, deck_sizes, np.flatnonzero(labels == label))
+        for label in range(labels.max() + 1)
+    ], dtype=np.int32)
+
+    noise = np.flatnonzero(labels < 0)
+
+    if len(noise):
+        common = (incidence[noise] @ incidence[medoids].T).toarray()
+        union = (
+            deck_sizes[noise][:, np.newaxis] +
+            deck_sizes[medoids][np.newaxis, :] - common
+        )
+        labels[noise] = np.argmax(common / union, axis=1)
+
+    return labels.astype(np.int32), medoids
+
+
+def nearest_clusters(snapshot, decklist_vec, n=3):
+    """
+    Returns ids of the n clusters whose medoids are most similar to
+    given decklist vector
+    """
+
+    scores = similarities(snapshot, decklist_vec, snapshot.medoids)
+
+    return np.argsort(-scores, kind="stable")[:n]
+
+
+def recommend(decklist, deck_color_identity, excludelist, land_mode=False,
+              snapshot=None, clusters=None):
+    """
+    Recommends cards for a given decklist based on ddb data. If number
+    of clusters is given, only decks in the archetype clusters nearest
+    to the decklist are scored
+    """
+
+    snapshot = snapshot or get_snapshot()
+    card_ids = snapshot.card_ids
+    num_decks = snapshot.num_decks
+    card_counts = snapshot.card_counts
+
+    with stage("similarity"):
+        decklist_vec = deck2vec(snapshot, decklist)
+
+        if clusters:
+            decks = np.flatnonzero(np.isin(
+                snapshot.deck_clusters,
+                nearest_clusters(snapshot, decklist_vec, clusters)
+            ))
+            ds = card_scores(
+                snapshot, similarities(snapshot, decklist_vec, decks), decks
+            )
+        else:
+            ds = card_scores(snapshot, similarities(snapshot, decklist_vec))
+
+    dif = decklist_filter(set(decklist))
+    candidates = filter(dif, snapshot.card_names)
+
+    mi_vals = inclusion_values(snapshot)
+    composites = 0.5 * card_counts / mi_vals + 0.5 * card_counts / num_decks
+    legal = ci_mask_filter(snapshot, deck_color_identity)
+    lands = has_type(snapshot, "Land")
+
+    def measure(x): return ds[card_ids[x]]
+    def mi_val(x): return mi_vals[card_ids[x]]
+    def composite(x): return composites[card_ids[x]]
+    def cif(x): return legal[card_ids[x]]
+    def lf(x): return lands[card_ids[x]]
     def ef(x): return x not in excludelist
+    def nbf(x): return snapshot.nonbasic[card_ids[x]]
 
     def cf(x):
         if land_mode:
-            return cif(x) and ef(x) and lf(x) and not_basic_land(x)
-        return cif(x) and ef(x) and (not lf(x)) #and (
-            #"Creature" not in s[x]["type_line"] and s[x]["cmc"] <= 4
-        #)
+            return cif(x) and ef(x) and lf(x) and nbf(x)
+        return cif(x) and ef(x) and (not lf(x))
+
+    with stage("sort"):
+        shortlist = sorted(
+            filter(cf, candidates), key=composite, reverse=True
+        )[:20]
+        shortlist = sorted(shortlist, key=measure, reverse=True)
 
-    shortlist = sorted(filter(cf, master), key=composite, reverse=True)[:20]
     output = ""
 
-    for i, card in enumerate(sorted(shortlist, key=measure, reverse=True)):
-        numbering = f"{i+1}.".ljust(4, " ")
-        card_name = f"{s[card]['full_name']}".ljust(40, " ")
+    with stage("format"):
+        for i, card in enumerate(shortlist):
+            numbering = f"{i+1}.".ljust(4, " ")
+            card_name = f"{snapshot.full_names[card_ids[card]]}".ljust(40, " ")
 
-        output += (
-            f"{numbering}{card_name}({all_cards[card]}/{mi_val(card)}) "
-            f"(DS: {measure(card):.3f})\n"
-        )
+            output += (
+                f"{numbering}{card_name}({card_counts[card_ids[card]]}/"
+                f"{mi_val(card)}) "
+                f"(DS: {measure(card):.3f})\n"
+            )
 
     return output
 
 
-def compare(decklist, deck_color_identity):
-    flat_dataset = load_normalized()
-    all_cards, num_decks = dataset_summary(flat_dataset)
-    df = create_dataframe(flat_dataset, all_cards)
-    decklist_vec = deck2vec(df, decklist)
+def compare(decklist, deck_color_identity, snapshot=None):
+    snapshot = snapshot or get_snapshot()
+    card_ids = snapshot.card_ids
 
-    master = {}
-    for deck in flat_dataset:
-        cur_filtered = filter(lambda x: x in decklist, flat_dataset[deck])
-        cur_score = similarity(df, decklist_vec, deck)
-
-        for card in cur_filtered:
-            if card not in master:
-                master[card] = []
-
-            master[card].append(cur_score)
+    with stage("similarity"):
+        decklist_vec = deck2vec(snapshot, decklist)
+        ds = card_scores(snapshot, similarities(snapshot, decklist_vec))
 
     def measure(x):
-        if x not in master:
+        if x not in card_ids:
             return 0
-        return np.power(np.prod(master[x]), 1 / len(master[x]))
+        return ds[card_ids[x]]
+
+    with stage("sort"):
+        ranked = sorted(decklist, key=measure)
 
     output = ""
 
-    for i, card in enumerate(sorted(decklist, key=measure)):
-        numbering = f"{i+1}.".ljust(4, " ")
-        card_name = f"{decklist[card]}".ljust(40, " ")
+    with stage("format"):
+        for i, card in enumerate(ranked):
+            numbering = f"{i+1}.".ljust(4, " ")
+            card_name = f"{decklist[card]}".ljust(40, " ")
 
-        output += (
-            f"{numbering}{card_name} "
-            f"(DS: {measure(card):.3f})\n"
-        )
+            output += (
+                f"{numbering}{card_name} "
+                f"(DS: {measure(card):.3f})\n"
+            )
 
     return output
 
 
+def decks2matrix(snapshot, decklists):
+    """
+    Transforms given decklists to a sparse binary matrix with one row
+    per decklist over the ddb card vocabulary. Cards outside the ddb and
+    basic lands are dropped
+    """
+
+    card_ids = snapshot.card_ids
+    rows, cols = [], []
+
+    for row, decklist in enumerate(decklists):
+        ids = {card_ids[c] for c in decklist if c in card_ids}
+        ids = [i for i in ids if snapshot.nonbasic[i]]
+        rows.extend([row] * len(ids))
+        cols.extend(ids)
+
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(decklists), len(snapshot.card_names))
+    )
+
+
+def batch_card_scores(snapshot, decklist_matrix):
+    """
+    Computes card scores of many decklists at once. Similarities
+    against every ddb deck come from a single sparse matrix-matrix
+    product, as do the copy weighted log sums per card
+    """
+
+    common = (decklist_matrix @ snapshot.incidence.T).toarray()
+    sizes = np.asarray(decklist_matrix.sum(axis=1))
+    union = sizes + snapshot.deck_sizes[np.newaxis, :] - common
+
+    with np.errstate(divide="ignore"):
+        log_scores = np.log(common / union)
+
+    log_sums = (snapshot.copies.T @ log_scores.T).T
+
+    return np.exp(log_sums / snapshot.card_counts)
+
+
+def recommend_batch(decklists, identities, excludelists=None,
+                    land_mode=False, k=20, snapshot=None):
+    """
+    Recommends cards for many decklists at once. Returns top k
+    recommendations of every decklist, ranked like recommend
+    """
+
+    snapshot = snapshot or get_snapshot()
+    card_ids = snapshot.card_ids
+    card_counts = snapshot.card_counts
+    excludelists = excludelists or [()] * len(decklists)
+
+    with stage("similarity"):
+        ds = batch_card_scores(snapshot, decks2matrix(snapshot, decklists))
+
+    mi_vals = inclusion_values(snapshot)
+    composites = (
+        0.5 * card_counts / mi_vals + 0.5 * card_counts / snapshot.num_decks
+    )
+    by_composite = np.argsort(-composites, kind="stable")
+    lands = has_type(snapshot, "Land")
+
+    if land_mode:
+        candidates = lands & snapshot.nonbasic
+    else:
+        candidates = ~lands
+
+    results = []
+
+    for row, (decklist, identity, excludelist) in enumerate(
+        zip(decklists, identities, excludelists)
+    ):
+        allowed = candidates & ci_mask_filter(snapshot, identity)
+        ids = [card_ids[c] for c in decklist if c in card_ids]
+        ids += [card_ids[c] for c in excludelist if c in card_ids]
+        allowed[ids] = False
+
+        shortlist = by_composite[allowed[by_composite]][:k]
+        shortlist = shortlist[np.argsort(-ds[row, shortlist], kind="stable")]
+
+        results.append([
+            {
+                "card": snapshot.full_names[i],
+                "decks": int(card_counts[i]),
+                "max_inclusion": int(mi_vals[i]),
+                "score": float(ds[row, i])
+            }
+            for i in shortlist
+        ])
+
+    return results
+
+
 def arithmetic_generality(deck, all_cards, num_decks):
     """
     Computes generality score by calculating arithmetic average of scores
@@ -585,76 +1406,223 @@ def decklist_generality_ranking(dataset, measure):
         print(f"{measure(deck):.3f}, {deck}")
 
 
-def generality_info(deck):
+def generality_table(snapshot):
     """
-    Computes generality scores of all ddb decks and given decklist
+    Scores arithmetic generality of every ddb deck once. Returns deck
+    names and scores sorted by score, plus card frequencies by raw name
+    for scoring further decklists
     """
 
-    dataset = load_database()
-    flat_dataset = flatten(dataset)
-    all_cards, num_decks = summary(dataset)
+    flat_dataset = snapshot.raw_flat_dataset
+    all_cards, num_decks = snapshot.raw_all_cards, snapshot.num_decks
     def measure(x): return arithmetic_generality(x, all_cards, num_decks)
+
+    ranking = sorted(
+        [[name, measure(flat_dataset[name])] for name in flat_dataset],
+        key=lambda x: x[1]
+    )
+
+    return {
+        "names": tuple(name for name, _ in ranking),
+        "scores": read_only(np.array([score for _, score in ranking])),
+        "raw_ids": MappingProxyType(card_vocabulary(snapshot.raw_names)),
+        # Trailing zero is the frequency of cards outside the ddb
+        "frequencies": read_only(
+            np.append(snapshot.card_counts / num_decks, 0)
+        )
+    }
+
+
+def generality_info(deck, snapshot=None):
+    """
+    Computes generality scores of all ddb decks and given decklist
+    """
+
+    snapshot = snapshot or get_snapshot()
+    table = snapshot.generality_distribution
+    raw_ids = table["raw_ids"]
+
+    if not deck:
+        score = 0
+    else:
+        ids = [raw_ids.get(card, -1) for card in filter(not_basic_land, deck)]
+        frequencies = table["frequencies"][ids]
+        score = sum(frequencies.tolist()) / len(ids)
+
+    position = np.searchsorted(table["scores"], score, side="right")
     generality_list = [
-        [name, measure(flat_dataset[name]), "blue"] for name in flat_dataset
+        [name, score, "blue"]
+        for name, score in zip(table["names"], table["scores"].tolist())
     ]
-    generality_list.append(["Your Deck", measure(deck), "red"])
+    generality_list.insert(position, ["Your Deck", score, "red"])
 
-    return list(sorted(generality_list, key=lambda x: x[1]))
+    return generality_list
 
 
-def generate_aggregate(any_base_cards):
-    data = load_normalized()
-    scry = load_lite()
+def decks_with_cards(snapshot, any_of=(), all_of=(), none_of=()):
+    """
+    Returns bitset of ddb decks, by position in snapshot.deck_names,
+    playing any of the first cards, all of the second and none of the
+    third. Empty lists do not restrict the result
+    """
 
-    aggregated_deck = dict()
-    num_decks = 0
+    def bits(card):
+        if card not in snapshot.card_ids:
+            return 0
+        return snapshot.deck_bitsets[snapshot.card_ids[card]]
+
+    result = (1 << snapshot.num_decks) - 1
+
+    if any_of:
+        matches = 0
+        for card in any_of:
+            matches |= bits(card)
+        result &= matches
+
+    for card in all_of:
+        result &= bits(card)
+
+    for card in none_of:
+        result &= ~bits(card)
+
+    return result
+
+
+def bitset_mask(snapshot, bitset):
+    """
+    Expands deck bitset into boolean array over snapshot.deck_names
+    """
+
+    packed = np.frombuffer(
+        bitset.to_bytes((snapshot.num_decks + 7) // 8, "little"),
+        dtype=np.uint8
+    )
 
-    for deck in data:
-        if any(c in data[deck] for c in any_base_cards):
-            num_decks += 1
-            for card in data[deck]:
-                if card in BASIC_LANDS:
-                    continue
-                if card not in aggregated_deck:
-                    aggregated_deck[card] = 0
+    return np.unpackbits(packed, bitorder="little")[:snapshot.num_decks] == 1
 
-                aggregated_deck[card] += 1
 
-    for x in sorted([c for c in aggregated_deck], key=lambda x: aggregated_deck[x]):
+def bitset_decks(snapshot, bitset):
+    """
+    Returns names of decks in given deck bitset
+    """
+
+    return [
+        snapshot.deck_names[i]
+        for i in np.flatnonzero(bitset_mask(snapshot, bitset))
+    ]
+
+
+def aggregate_decks(snapshot, bitset):
+    """
+    Counts card copies over decks in given deck bitset, ordered like
+    snapshot.card_names
+    """
+
+    mask = bitset_mask(snapshot, bitset).astype(np.int32)
+
+    return snapshot.copies.T @ mask
+
+
+def generate_aggregate(any_base_cards, snapshot=None):
+    snapshot = snapshot or get_snapshot()
+    scry = snapshot.scryfall
+
+    bitset = decks_with_cards(snapshot, any_of=any_base_cards)
+    aggregated_deck = aggregate_decks(snapshot, bitset)
+    num_decks = int(bitset_mask(snapshot, bitset).sum())
+
+    played = np.flatnonzero((aggregated_deck > 0) & snapshot.nonbasic)
+
+    for i in played[np.argsort(aggregated_deck[played], kind="stable")]:
+        x = snapshot.card_names[i]
         if scry[x]["type_line"] == "Land":
             continue
-        print(f"{aggregated_deck[x]}/{num_decks}", x)
+        print(f"{aggregated_deck[i]}/{num_decks}", x)
 
 
-def synergy_increase(base_card):
-    data = load_normalized()
-    scry = load_lite() 
-    all_cards, _ = dataset_summary(data)
-    dcr = deck_rep_by_color(load_database())
-    decks = data.values()
+def card_synergies(snapshot, base_card):
+    """
+    Computes synergy of every card with given base card from the
+    co-occurrence matrix. Lift compares how often a card is played in
+    decks with the base card against all decks that could play it,
+    increase compares against decks in the combined color identity
+    """
+
+    i = snapshot.card_ids[base_card]
+    together = snapshot.cooccurrence[i].toarray().ravel()
+    decks = snapshot.cooccurrence.diagonal()
+    mi_vals = inclusion_values(snapshot)
+    base_rate = decks / mi_vals
+
+    with_base = snapshot.incidence[:, i].nonzero()[0]
+    in_base_decks = inclusion_table(snapshot.deck_masks[with_base])
+    in_pair = snapshot.inclusion[snapshot.card_masks | snapshot.card_masks[i]]
 
-    def syn_inc(x):
-        one = num_decks_with_card(x, decks)
-        if not one: return 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lift = (
+            together / in_base_decks[snapshot.card_masks] - base_rate
+        ) / base_rate
+        increase = mi_vals * (together / in_pair - base_rate) / decks
 
-        two = max_inclusion_value(x, dcr, scry)
-        three = num_decks_with_cards(x, base_card, decks)
-        four = miv_dual(x, base_card, dcr, scry)
+    lift[together == 0] = 0
 
-        return two * (three/four - one/two) / one
+    return {
+        "together": together,
+        "decks": decks,
+        "lift": lift,
+        "increase": increase
+    }
+
+
+def top_synergies(snapshot, base_card, n=20, measure="lift", lands=False,
+                  min_decks=2):
+    """
+    Returns top n synergy partners of given base card by lift or
+    increase, skipping cards played in fewer than min_decks decks
+    """
+
+    synergies = card_synergies(snapshot, base_card)
+    scores = synergies[measure]
+
+    candidates = synergies["decks"] >= min_decks
+    candidates[snapshot.card_ids[base_card]] = False
+
+    if not lands:
+        candidates &= ~has_type(snapshot, "Land")
+
+    ids = np.flatnonzero(candidates & (scores > 0))
+    ids = ids[np.argsort(-scores[ids], kind="stable")][:n]
+
+    return [
+        {
+            "card": snapshot.full_names[j],
+            "decks": int(synergies["decks"][j]),
+            "together": int(synergies["together"][j]),
+            measure: float(scores[j])
+        }
+        for j in ids
+    ]
+
+
+def synergy_increase(base_card, snapshot=None):
+    snapshot = snapshot or get_snapshot()
+    syn_inc = card_synergies(snapshot, base_card)["increase"]
+    card_ids = snapshot.card_ids
+    lands = has_type(snapshot, "Land")
+    decks = snapshot.cooccurrence.diagonal()
 
     for card in sorted(
         filter(
             lambda x: (all([
-                "Land" not in scry[x]["type_line"],
-                syn_inc(x) > 0,
-                num_decks_with_card(x) > 1,  # Hack
+                not lands[card_ids[x]],
+                syn_inc[card_ids[x]] > 0,
+                decks[card_ids[x]] > 1,  # Hack
             ])),
-            all_cards
+            snapshot.card_names
         ),
-        key=syn_inc
+        key=lambda x: syn_inc[card_ids[x]]
     ):
-        print(f"+{round(syn_inc(card), 3)}\t{card}")
+        print(f"+{round(syn_inc[card_ids[card]], 3)}\t{card}")
 
 
 def db_ci_info(data=None):
@@ -668,100 +1636,112 @@ def db_ci_info(data=None):
     return deck_ci
 
 
-def nonland_synergy(x):
-    data = load_normalized()
-    database = load_database()
-
-    scry = load_lite() 
-    all_cards, _ = dataset_summary(data)
-    dcr = deck_rep_by_color(database)
-    deck_ci = db_ci_info(database)
-
-    decks_with_base_card = []
-    for deck in data:
-        if x in data[deck]:
-            decks_with_base_card.append(deck)
-
-    datavals = data.values()
-    result = []
-    for y in all_cards:
-        if "Land" in scry[y]["type_line"]:
-            continue
-        yci = set(scry[y]["color_identity"])
-
-        # decks with y
-        a = num_decks_with_card(y, datavals)
-        
-        # decks with y ci
-        b = max_inclusion_value(y, dcr, scry)
-
-        # decks with base_card and y
-        c = sum(y in data[deck] for deck in decks_with_base_card) 
-
-        # decks with base_card and y ci
-        d = sum(yci.issubset(deck_ci[deck]) for deck in decks_with_base_card)
+def nonland_synergy(x, snapshot=None):
+    snapshot = snapshot or get_snapshot()
+    synergies = card_synergies(snapshot, x)
+    lands = has_type(snapshot, "Land")
 
-        if c == 0:
-            increase = 0
-        else:
-            increase = (c/d - a/b) / (a/b)
-
-        #print(f"{a}/{b}\t{c}/{d}\t{round(increase, 4)}\t{y}")
-        result.append([increase, y])
+    result = [
+        [synergies["lift"][i] if synergies["together"][i] else 0, y]
+        for i, y in enumerate(snapshot.card_names) if not lands[i]
+    ]
 
     for increase, card in sorted(result, key=lambda x: x[0], reverse=True):
         print(round(increase, 4), card)
 
 
 def miv_dual(x, y, dcr, scry):
-    ci = list(set(scry[x]["color_identity"]) | set(scry[y]["color_identity"]))
-    colorless = not ci
-    max_inclusion = 0
+    mask = (color_mask(scry[x]["color_identity"]) |
+            color_mask(scry[y]["color_identity"]))
 
-    for color_combo in dcr:
-        if all(c in color_combo.upper() for c in ci) or colorless:
-            max_inclusion += dcr[color_combo]
-
-    return max_inclusion
+    return sum(
+        dcr[color_combo] for color_combo in dcr
+        if color_mask(color_combo) & mask == mask
+    )
 
 
 def num_decks_with_card(x, decks=None):
     if not decks:
-        decks = load_normalized().values()
+        return num_decks_with_cards(x, x)
     return sum(x in deck for deck in decks)
 
 
 def num_decks_with_cards(x, y, decks=None):
     if not decks:
-        decks = load_normalized().values()
+        snapshot = get_snapshot()
+        if x not in snapshot.card_ids or y not in snapshot.card_ids:
+            return 0
+        i, j = snapshot.card_ids[x], snapshot.card_ids[y]
+        return int(snapshot.cooccurrence[i, j])
     return sum((x in deck) and (y in deck) for deck in decks)
 
 
-def create_core(colors, ratio=0.75):
-    colors = [x.lower() for x in colors]
-    color_code = "".join([x for x in "wubrg" if x in colors])
-    data_complex = load_database()
-    
+def count_cards(decklists):
+    """
+    Counts nonbasic cards over given raw decklists. Returns number of
+    decks, card names sorted by count, most played first, and the
+    negated counts in the same ascending order for binary search
+    """
+
     aggregate = dict()
     num_decks = 0
 
+    for decklist in decklists:
+        num_decks += 1
+        for card in decklist:
+            if normalize(card) in BASIC_LANDS:
+                continue
+
+            if card not in aggregate:
+                aggregate[card] = 0
+
+            aggregate[card] += 1
+
+    names = sorted(aggregate, key=lambda x: aggregate[x], reverse=True)
+    negated = np.array([-aggregate[c] for c in names], dtype=np.int64)
+
+    return num_decks, tuple(names), read_only(negated)
+
+
+def core_table(data_complex):
+    """
+    Materializes sorted card counts of every color code in the ddb,
+    keyed by (color_code, None), and of every deck type within it,
+    keyed by (color_code, deck_type)
+    """
+
+    table = {}
+
     for c in data_complex:
-        if c == color_code:
-            for d in data_complex[c]:
-                for deck in data_complex[c][d]:
-                    num_decks += 1
-                    for card in data_complex[c][d][deck]:
-                        if normalize(card) in BASIC_LANDS:
-                            continue
+        table[(c, None)] = count_cards(
+            data_complex[c][d][deck]
+            for d in data_complex[c]
+            for deck in data_complex[c][d]
+        )
+
+        for d in data_complex[c]:
+            table[(c, d)] = count_cards(data_complex[c][d].values())
+
+    return table
+
 
-                        if card not in aggregate:
-                            aggregate[card] = 0
+def create_core(colors, ratio=0.75, snapshot=None, deck_type=None):
+    """
+    Lists cards played in at least ratio of the ddb decks of given
+    colors, optionally only of a single deck type
+    """
+
+    colors = [x.lower() for x in colors]
+    color_code = "".join([x for x in "wubrg" if x in colors])
+    core_counts = (snapshot or get_snapshot()).core_counts
 
-                        aggregate[card] += 1
+    if (color_code, deck_type) not in core_counts:
+        return ""
 
-    core = [c for c in aggregate if aggregate[c] >= ratio * num_decks]
+    num_decks, names, negated = core_counts[(color_code, deck_type)]
+    cut = np.searchsorted(negated, -ratio * num_decks, side="right")
 
-    return "\n".join([f"1 {c}" for c in sorted(core, key=lambda x: aggregate[x], reverse=True)])
+    return "\n".join([f"1 {c}" for c in names[:cut]])
 
 
 if __name__ == "__main__":
@@ -809,9 +1789,10 @@ if __name__ == "__main__":
     """
     #print()
     #not_played_card = "mox diamond"
-    #for deck in data:
-    #    if not_played_card not in data[deck]:
-    #        print(deck)
+    #snapshot = get_snapshot()
+    #bitset = decks_with_cards(snapshot, none_of=[not_played_card])
+    #for deck in bitset_decks(snapshot, bitset):
+    #    print(deck)
     ###############################################
 
     #generate_aggregate(["protean hulk", ])
@@ -1,18 +1,210 @@
-import time
+import os
 import re
+import time
+import tempfile
+import threading
 
 from flask import Flask
+from flask import g
 from flask import json
 from flask import request
 from flask import Response
-
-from analyze import recommend, generality_info, compare, create_core
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from analyze import (
+    recommend, recommend_batch, generality_info, compare, create_core,
+    top_synergies, decks_with_cards, bitset_decks, aggregate_decks,
+    get_snapshot, warm_snapshot
+)
+from cache import cache_key, ResultCache
 from data_cleanup import normalize
-from scraper import parse_decklist_platform
+from jobs import FetchJobs
+from metrics import (
+    registry, stage, begin_request, end_request, server_timing
+)
+from profiling import install as install_profiling
+from ratelimit import default_store, rate_limit
+from resolver import get_resolver, resolution_report
 
 
 app = Flask(__name__)
 
+# Proxies in front of the app whose X-Forwarded-For entry is trusted as
+# the client address, 1 behind the Heroku router. With 0 the peer
+# address is used, so clients cannot pick their own rate limit bucket
+app.wsgi_app = ProxyFix(
+    app.wsgi_app, x_for=int(os.environ.get("PROXY_HOPS", 0))
+)
+
+# Set once the snapshot, resolver and tables requests read are built.
+# gunicorn.conf.py warms up in the master before workers are forked
+warm = threading.Event()
+_warm_lock = threading.Lock()
+_warm_thread = None
+
+result_cache = ResultCache(
+    maxsize=int(os.environ.get("RESULT_CACHE_SIZE", 512)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 600))
+)
+
+# Per client token buckets: sustained requests per second and burst size.
+# Over quota requests are rejected with 429 and Retry-After
+limit_store = default_store()
+ANALYSIS_LIMIT = {
+    "rate": float(os.environ.get("ANALYSIS_RATE", 1)),
+    "burst": int(os.environ.get("ANALYSIS_BURST", 5))
+}
+
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 256))
+
+# Score recommendations only within this many nearest archetype clusters,
+# 0 scores against every ddb deck
+RECOMMEND_CLUSTERS = int(os.environ.get("RECOMMEND_CLUSTERS", 0))
+
+# Requests sending this secret in the X-Profile header are profiled into
+# PROFILE_DIR. Profiling is off when no secret is configured
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET")
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "cedh_profiles")
+)
+
+REQUESTS = registry.counter(
+    "cedh_requests_total",
+    "Requests answered, by endpoint and status code",
+    labels=("endpoint", "status")
+)
+REQUEST_SECONDS = registry.histogram(
+    "cedh_request_seconds",
+    "Time to answer a request, by endpoint",
+    labels=("endpoint",)
+)
+SCRAPE_SECONDS = registry.histogram(
+    "cedh_scrape_seconds",
+    "Time to scrape a decklist from its platform",
+    labels=("platform",)
+)
+registry.callback(
+    "cedh_result_cache_hits_total", "Result cache hits", "counter",
+    lambda: result_cache.stats()["hits"]
+)
+registry.callback(
+    "cedh_result_cache_misses_total", "Result cache misses", "counter",
+    lambda: result_cache.stats()["misses"]
+)
+registry.callback(
+    "cedh_result_cache_entries", "Results currently cached", "gauge",
+    lambda: result_cache.stats()["size"]
+)
+registry.callback(
+    "cedh_snapshot_info", "Version of the dataset snapshot being served",
+    "gauge", lambda: [({"version": get_snapshot().version}, 1)]
+)
+registry.callback(
+    "cedh_snapshot_decks", "Decks in the dataset snapshot", "gauge",
+    lambda: get_snapshot().num_decks
+)
+
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    begin_request()
+
+
+@app.after_request
+def record_timing(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "unknown"
+    timings = end_request() + [("total", elapsed)]
+
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    response.headers["Server-Timing"] = server_timing(timings)
+
+    return response
+
+
+install_profiling(app, PROFILE_SECRET, PROFILE_DIR)
+
+
+def cached_result(version, key, compute):
+    """
+    Returns result from the result cache, computing it on a miss.
+    Profiled requests always compute so the profile covers the analysis
+    """
+
+    if g.get("profiler") is not None:
+        return compute()
+
+    return result_cache.get_or_compute(version, key, compute)
+
+
+def warm_up():
+    """
+    Builds the dataset snapshot, its lookup tables and the card resolver
+    so that no request pays for them
+    """
+
+    warm_snapshot(get_snapshot())
+    get_resolver()
+    warm.set()
+
+
+def start_warm_up():
+    """
+    Warms up on a background thread, at most once per process
+    """
+
+    global _warm_thread
+
+    with _warm_lock:
+        if _warm_thread is None:
+            _warm_thread = threading.Thread(target=warm_up, daemon=True)
+            _warm_thread.start()
+
+
+def parse_excludelist(excludelist):
+    """
+    Strips counts, numbering and set codes from pasted exclude list lines
+    """
+
+    card_names = []
+
+    for card in excludelist.split("\n"):
+        if card:
+            clean_card = card.split("(")[0]
+            clean_card = re.search(r"[0-9]*\.?\s*(.+)", clean_card).group(1)
+            card_names.append(clean_card.strip())
+
+    return card_names
+
+
+def resolve_cards(decklist, excludelist):
+    """
+    Resolves pasted decklist and exclude list card names against the card
+    dictionary. Returns both as normalized names and a note listing
+    corrected and unknown cards
+    """
+
+    resolver = get_resolver()
+
+    with stage("resolve"):
+        clean_decklist, corrected, unresolved = resolver.resolve_all([
+            " ".join(card.split()[1:])
+            for card in decklist.split("\n") if card
+        ])
+        clean_excludelist, exclude_corrected, exclude_unresolved = (
+            resolver.resolve_all(parse_excludelist(excludelist))
+        )
+    corrected.update(exclude_corrected)
+    unresolved += exclude_unresolved
+
+    return (
+        clean_decklist,
+        clean_excludelist,
+        resolution_report(corrected, unresolved)
+    )
+
 
 @app.route("/", methods=["GET"])
 def index():
@@ -20,11 +212,22 @@ def index():
     return Response(content, mimetype="text/html")
 
 
-@app.route("/fetch", methods=["POST"])
-def fetch_decklist():
-    data_json = json.loads(request.data)
+def fetch_job(url):
+    """
+    Scrapes decklist from its platform. Runs on the fetch thread pool
+    """
+
+    # Scraping dependencies are only imported by workers that fetch
+    from scraper import parse_decklist_platform, platform_of
 
-    decklist = parse_decklist_platform(data_json["url"], wait_time=2)
+    start = time.perf_counter()
+
+    with stage("scrape"):
+        decklist = parse_decklist_platform(url)
+
+    SCRAPE_SECONDS.observe(
+        time.perf_counter() - start, platform=platform_of(url) or "unknown"
+    )
     fetch_result = ""
 
     for card in decklist:
@@ -32,118 +235,350 @@ def fetch_decklist():
 
     fetch_result.strip("\n")
 
+    return {
+        "decklist": fetch_result,
+        "generality": generality_info(decklist, snapshot=get_snapshot())
+    }
+
+
+fetch_jobs = FetchJobs(
+    fetch_job,
+    filename=os.environ.get("FETCH_JOB_FILE"),
+    max_workers=int(os.environ.get("FETCH_WORKERS", 4))
+)
+
+
+@app.route("/ready", methods=["GET"])
+def readiness():
+    if not warm.is_set():
+        start_warm_up()
+        return Response(
+            json.dumps({"status": "warming"}),
+            status=503,
+            mimetype="application/json"
+        )
+
     return Response(
-        json.dumps({
-            "decklist": fetch_result,
-            "generality": generality_info(decklist)
-        }),
+        json.dumps({"status": "ready", "snapshot": get_snapshot().version}),
         status=200,
         mimetype="application/json"
     )
 
 
+@app.route("/metrics", methods=["GET"])
+def export_metrics():
+    return Response(
+        registry.render(),
+        status=200,
+        mimetype="text/plain; version=0.0.4"
+    )
+
+
+@app.route("/fetch", methods=["POST"])
+def fetch_decklist():
+    data_json = json.loads(request.data)
+    job_id = fetch_jobs.submit(data_json["url"].strip())
+
+    # A recent fetch of the same url may be reused and already finished
+    result = dict(fetch_jobs.status(job_id), job_id=job_id)
+
+    return Response(
+        json.dumps(result),
+        status=202 if result["status"] == "pending" else 200,
+        mimetype="application/json"
+    )
+
+
+@app.route("/fetch/<job_id>", methods=["GET"])
+def fetch_status(job_id):
+    result = fetch_jobs.status(job_id)
+
+    if result is None:
+        return Response(
+            json.dumps({"status": "unknown"}),
+            status=404,
+            mimetype="application/json"
+        )
+
+    return Response(json.dumps(result), status=200, mimetype="application/json")
+
+
 @app.route("/compare", methods=["POST"])
+@rate_limit(limit_store, **ANALYSIS_LIMIT)
 def compare_against_ddb():
     data_json = json.loads(request.data)
     decklist = data_json["decklist"]
     identity = data_json["identity"]
     clean_decklist = {}
+    resolver = get_resolver()
+    corrected = {}
+    unresolved = []
 
-    for card in decklist.split("\n"):
-        if card:
-            clean_card = " ".join(card.split()[1:])
-            clean_decklist[normalize(clean_card)] = clean_card
+    with stage("resolve"):
+        for card in decklist.split("\n"):
+            if card:
+                clean_card = " ".join(card.split()[1:])
+                resolved = resolver.resolve(clean_card)
+
+                if resolved is None:
+                    unresolved.append(clean_card)
+                    continue
+
+                if resolved != normalize(clean_card):
+                    corrected[clean_card] = resolver.full_names[resolved]
+                    clean_card = corrected[clean_card]
+
+                clean_decklist[resolved] = clean_card
+
+    note = resolution_report(corrected, unresolved)
 
     if not clean_decklist:
         fetch_result = ("No decklist provided! Fetch via decklist "
                         "URL or paste in above text box.")
     else:
-        fetch_result = compare(clean_decklist, identity)
-
-    time.sleep(1)
+        snapshot = get_snapshot()
+        fetch_result = cached_result(
+            snapshot.version,
+            cache_key("compare", clean_decklist.items(), identity),
+            lambda: compare(clean_decklist, identity, snapshot=snapshot)
+        )
+        fetch_result = note + fetch_result
 
     return Response(fetch_result, status=200, mimetype="application/json")
 
 
 @app.route("/recommend_lands", methods=["POST"])
+@rate_limit(limit_store, **ANALYSIS_LIMIT)
 def recommend_lands():
     data_json = json.loads(request.data)
     decklist = data_json["decklist"]
     excludelist = data_json["excludelist"]
     identity = data_json["identity"]
-    clean_decklist = []
-    clean_excludelist = []
-
-    for card in decklist.split("\n"):
-        if card:
-            clean_card = " ".join(card.split()[1:])
-            clean_decklist.append(normalize(clean_card))
-
-    for card in excludelist.split("\n"):
-        if card:
-            clean_card = card.split("(")[0]
-            clean_card = re.search(r"[0-9]*\.?\s*(.+)", clean_card).group(1)
-            clean_excludelist.append(normalize(clean_card.strip()))
+    clean_decklist, clean_excludelist, note = resolve_cards(
+        decklist, excludelist
+    )
 
     if not clean_decklist:
         fetch_result = ("No decklist provided! Fetch via decklist "
                         "URL or paste in above text box.")
     else:
-        fetch_result = recommend(
-            clean_decklist,
-            identity,
-            clean_excludelist,
-            land_mode=True
+        snapshot = get_snapshot()
+        fetch_result = cached_result(
+            snapshot.version,
+            cache_key(
+                "recommend",
+                clean_decklist,
+                identity,
+                clean_excludelist,
+                land_mode=True
+            ),
+            lambda: recommend(
+                clean_decklist,
+                identity,
+                clean_excludelist,
+                land_mode=True,
+                snapshot=snapshot,
+                clusters=RECOMMEND_CLUSTERS
+            )
         )
-
-    time.sleep(1)
+        fetch_result = note + fetch_result
 
     return Response(fetch_result, status=200, mimetype="application/json")
 
 
 @app.route("/recommend", methods=["POST"])
+@rate_limit(limit_store, **ANALYSIS_LIMIT)
 def recommend_cards():
     data_json = json.loads(request.data)
     decklist = data_json["decklist"]
     excludelist = data_json["excludelist"]
     identity = data_json["identity"]
-    clean_decklist = []
-    clean_excludelist = []
-
-    for card in decklist.split("\n"):
-        if card:
-            clean_card = " ".join(card.split()[1:])
-            clean_decklist.append(normalize(clean_card))
-
-    for card in excludelist.split("\n"):
-        if card:
-            clean_card = card.split("(")[0]
-            clean_card = re.search(r"[0-9]*\.?\s*(.+)", clean_card).group(1)
-            clean_excludelist.append(normalize(clean_card.strip()))
+    clean_decklist, clean_excludelist, note = resolve_cards(
+        decklist, excludelist
+    )
 
     if not clean_decklist:
         fetch_result = ("No decklist provided! Fetch via decklist "
                         "URL or paste in above text box.")
     else:
-        fetch_result = recommend(clean_decklist, identity, clean_excludelist)
-
-    time.sleep(1)
+        snapshot = get_snapshot()
+        fetch_result = cached_result(
+            snapshot.version,
+            cache_key("recommend", clean_decklist, identity, clean_excludelist),
+            lambda: recommend(
+                clean_decklist,
+                identity,
+                clean_excludelist,
+                snapshot=snapshot,
+                clusters=RECOMMEND_CLUSTERS
+            )
+        )
+        fetch_result = note + fetch_result
 
     return Response(fetch_result, status=200, mimetype="application/json")
 
 
+@app.route("/recommend_batch", methods=["POST"])
+@rate_limit(limit_store, **ANALYSIS_LIMIT)
+def recommend_cards_batch():
+    data_json = json.loads(request.data)
+    decks = data_json["decks"]
+
+    if not decks or len(decks) > MAX_BATCH_SIZE:
+        return Response(
+            json.dumps({
+                "error": f"Provide between 1 and {MAX_BATCH_SIZE} decks."
+            }),
+            status=400,
+            mimetype="application/json"
+        )
+
+    resolver = get_resolver()
+    decklists, excludelists, notes = [], [], []
+
+    with stage("resolve"):
+        for deck in decks:
+            clean_decklist, corrected, unresolved = resolver.resolve_all([
+                " ".join(card.split()[1:])
+                for card in deck["decklist"].split("\n") if card
+            ])
+            clean_excludelist, exclude_corrected, exclude_unresolved = (
+                resolver.resolve_all(
+                    parse_excludelist(deck.get("excludelist", ""))
+                )
+            )
+            corrected.update(exclude_corrected)
+
+            decklists.append(clean_decklist)
+            excludelists.append(clean_excludelist)
+            notes.append({
+                "corrected": corrected,
+                "unknown": unresolved + exclude_unresolved
+            })
+
+    results = recommend_batch(
+        decklists,
+        [deck["identity"] for deck in decks],
+        excludelists,
+        land_mode=bool(data_json.get("land_mode", False)),
+        k=int(data_json.get("k", 20)),
+        snapshot=get_snapshot()
+    )
+
+    for note, recommendations in zip(notes, results):
+        note["recommendations"] = recommendations
+
+    return Response(
+        json.dumps({"results": notes}),
+        status=200,
+        mimetype="application/json"
+    )
+
+
+@app.route("/synergy", methods=["POST"])
+@rate_limit(limit_store, **ANALYSIS_LIMIT)
+def card_synergy():
+    data_json = json.loads(request.data)
+    measure = data_json.get("measure", "lift")
+    card = get_resolver().resolve(data_json["card"])
+    snapshot = get_snapshot()
+
+    if measure not in ("lift", "increase"):
+        return Response(
+            json.dumps({"error": "Measure must be lift or increase."}),
+            status=400,
+            mimetype="application/json"
+        )
+
+    if card not in snapshot.card_ids:
+        return Response(
+            json.dumps({"error": "Card is not played in the ddb."}),
+            status=404,
+            mimetype="application/json"
+        )
+
+    result = {
+        "card": snapshot.full_names[snapshot.card_ids[card]],
+        "measure": measure,
+        "partners": top_synergies(
+            snapshot,
+            card,
+            n=int(data_json.get("n", 20)),
+            measure=measure,
+            lands=bool(data_json.get("lands", False))
+        )
+    }
+
+    return Response(json.dumps(result), status=200, mimetype="application/json")
+
+
+@app.route("/decks", methods=["POST"])
+@rate_limit(limit_store, **ANALYSIS_LIMIT)
+def query_decks():
+    data_json = json.loads(request.data)
+    resolver = get_resolver()
+    snapshot = get_snapshot()
+    queries = {}
+    corrected = {}
+    unresolved = []
+
+    for field in ("any", "all", "none"):
+        cards, field_corrected, field_unresolved = resolver.resolve_all(
+            data_json.get(field, [])
+        )
+        # Unknown cards are played in no deck, which still matters to "all"
+        queries[field] = cards + field_unresolved
+        corrected.update(field_corrected)
+        unresolved += field_unresolved
+
+    bitset = decks_with_cards(
+        snapshot,
+        any_of=queries["any"],
+        all_of=queries["all"],
+        none_of=queries["none"]
+    )
+    decks = bitset_decks(snapshot, bitset)
+    counts = aggregate_decks(snapshot, bitset)
+
+    played = [i for i in counts.nonzero()[0] if snapshot.nonbasic[i]]
+    played.sort(key=lambda i: counts[i], reverse=True)
+
+    result = {
+        "corrected": corrected,
+        "unknown": unresolved,
+        "num_decks": len(decks),
+        "decks": decks,
+        "aggregate": [
+            {"card": snapshot.full_names[i], "decks": int(counts[i])}
+            for i in played[:int(data_json.get("n", 100))]
+        ]
+    }
+
+    return Response(json.dumps(result), status=200, mimetype="application/json")
+
+
 @app.route("/generate_core", methods=["POST"])
 def generate_core():
     data_json = json.loads(request.data)
 
     identity = data_json["identity"]
     raw_ratio = data_json["ratio"]
+    deck_type = data_json.get("deck_type") or None
 
     if not raw_ratio:
-        result = create_core(identity)
+        result = create_core(
+            identity,
+            snapshot=get_snapshot(),
+            deck_type=deck_type
+        )
     else:
         try:
-            result = create_core(identity, float(raw_ratio))
+            result = create_core(
+                identity,
+                float(raw_ratio),
+                snapshot=get_snapshot(),
+                deck_type=deck_type
+            )
         except ValueError:
             result = "Invalid ratio value specified!"
 
@@ -151,4 +586,5 @@ def generate_core():
 
 
 if __name__ == "__main__":
+    warm_up()
     app.run(host="localhost", port=5000)
@@ -0,0 +1,198 @@
+"""
+Times the analysis functions on synthetic ddbs at several multiples of
+the real deck count. Every scale runs in a fresh interpreter inside a
+temporary directory holding the synthetic json_data, so snapshots and
+lazily built tables are measured from a cold start.
+
+Results are appended to benchmarks/results/analysis.jsonl together with
+the current commit, and every run is compared against the previous run
+at the same scale.
+
+Run from the repository root, optionally with the scales to run:
+    python -m benchmarks.analysis
+    python -m benchmarks.analysis 1 10
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import contextlib
+import subprocess
+
+from benchmarks.synthetic_ddb import generate, write
+
+
+SCALES = [1, 10, 100]
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), "results",
+                            "analysis.jsonl")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUN_COMMAND = "from benchmarks.analysis import run; run()"
+
+
+def timed(func, repeat=5):
+    """
+    Returns wall clock time of the first call and best time of repeat
+    further calls, both in milliseconds
+    """
+
+    start = time.perf_counter()
+    func()
+    cold = time.perf_counter() - start
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return {"cold": 1000 * cold, "warm": 1000 * best}
+
+
+def run(repeat=5):
+    """
+    Times analysis functions against the ddb in the working directory
+    and prints the timings as json
+    """
+
+    import analyze
+
+    start = time.perf_counter()
+    snapshot = analyze.get_snapshot()
+    elapsed = 1000 * (time.perf_counter() - start)
+    timings = {"snapshot": {"cold": elapsed, "warm": None}}
+
+    deck = snapshot.deck_names[0]
+    decklist = list(snapshot.flat_dataset[deck])
+    raw_decklist = list(snapshot.raw_flat_dataset[deck])
+    identity = snapshot.deck_colors[0]
+    base_card = snapshot.card_names[int(snapshot.card_counts.argmax())]
+
+    def quiet(func, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args)
+
+    benchmarks = {
+        "recommend": lambda: analyze.recommend(
+            decklist, identity, [], snapshot=snapshot
+        ),
+        "recommend_lands": lambda: analyze.recommend(
+            decklist, identity, [], land_mode=True, snapshot=snapshot
+        ),
+        "compare": lambda: analyze.compare(
+            {card: card for card in decklist}, identity, snapshot=snapshot
+        ),
+        "generality_info": lambda: analyze.generality_info(
+            raw_decklist, snapshot=snapshot
+        ),
+        "create_core": lambda: analyze.create_core(
+            list(identity), 0.5, snapshot=snapshot
+        ),
+        "nonland_synergy": lambda: quiet(
+            analyze.nonland_synergy, base_card, snapshot
+        )
+    }
+
+    for name, func in benchmarks.items():
+        timings[name] = timed(func, repeat)
+
+    print(json.dumps({
+        "num_decks": snapshot.num_decks,
+        "num_cards": len(snapshot.card_names),
+        "timings": timings
+    }))
+
+
+def run_scale(scale):
+    """
+    Generates ddb at given scale and times it in a fresh interpreter
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        write(directory, *generate(scale))
+
+        output = subprocess.run(
+            [sys.executable, "-c", RUN_COMMAND],
+            cwd=directory,
+            env=dict(os.environ, PYTHONPATH=REPO_ROOT),
+            check=True,
+            stdout=subprocess.PIPE
+        ).stdout
+
+    return json.loads(output)
+
+
+def previous_runs():
+    """
+    Returns last recorded result of every scale
+    """
+
+    previous = {}
+
+    if os.path.exists(RESULTS_FILE):
+        with open(RESULTS_FILE) as f:
+            for line in f:
+                record = json.loads(line)
+                previous[record["scale"]] = record
+
+    return previous
+
+
+def commit(checkout=REPO_ROOT):
+    def git(*args):
+        return subprocess.run(
+            ["git", *args],
+            cwd=checkout, check=True, stdout=subprocess.PIPE,
+            universal_newlines=True
+        ).stdout.strip()
+
+    try:
+        label = git("describe", "--always")
+        # Results appended by benchmarks do not change the measured code
+        if git("status", "--porcelain", "--untracked-files=no", "--", ".",
+               ":(exclude)benchmarks/results"):
+            label += "-dirty"
+        return label
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(record, previous):
+    print(f"\n{record['scale']}x: {record['num_decks']} decks, "
+          f"{record['num_cards']} cards")
+    print(f"{'':18}{'cold (ms)':>12}{'warm (ms)':>12}{'vs last':>10}")
+
+    for name, timing in record["timings"].items():
+        change = ""
+
+        key = "cold" if timing["warm"] is None else "warm"
+
+        if previous and name in previous["timings"]:
+            last = previous["timings"][name][key]
+            change = f"{100 * (timing[key] / last - 1):+.0f}%"
+
+        warm = "-" if timing["warm"] is None else f"{timing['warm']:.3f}"
+        print(f"{name:18}{timing['cold']:>12.2f}{warm:>12}{change:>10}")
+
+
+def main(scales=SCALES):
+    previous = previous_runs()
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+
+    for scale in scales:
+        record = dict(
+            run_scale(scale),
+            scale=scale,
+            commit=commit(),
+            time=time.strftime("%Y-%m-%dT%H:%M:%S")
+        )
+        report(record, previous.get(scale))
+
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main([int(scale) for scale in sys.argv[1:]] or SCALES)
@@ -0,0 +1,71 @@
+"""
+Crawls decklists from the local platform stub and compares wall clock
+time against the sequential one-deck-at-a-time estimate. Also checks
+that no platform was hit faster than its delay allows, then replays the
+recorded responses offline with the stub shut down.
+
+Run from the repository root:
+    python -m benchmarks.crawl
+"""
+
+import time
+import tempfile
+
+import scraper
+
+from analyze import load_lite
+from benchmarks.stub_platforms import start_stub, use_stub
+
+
+PLATFORMS = ["moxfield", "archidekt", "tappedout"]
+
+
+def main(decks_per_platform=10, delay=0.2, latency=0.05):
+    cards = [c["full_name"] for c in load_lite().values()]
+    server = start_stub(cards, latency=latency)
+    use_stub(server)
+
+    deck_urls = {
+        f"{p} {i}": server.deck_url(p, f"{p}{i}")
+        for p in PLATFORMS for i in range(decks_per_platform)
+    }
+
+    scraper.HTTP_CACHE_DIR = tempfile.mkdtemp()
+    scraper.HTTP_CACHE_MODE = "record"
+
+    start = time.perf_counter()
+    decklists = scraper.crawl(deck_urls, delays={p: delay for p in PLATFORMS})
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    scraper.HTTP_CACHE_MODE = "replay"
+
+    start = time.perf_counter()
+    replayed = scraper.crawl(deck_urls, delays={p: 0 for p in PLATFORMS})
+    replay_elapsed = time.perf_counter() - start
+    assert replayed == decklists
+
+    for name, url in deck_urls.items():
+        expected = server.decklist(url.rstrip("/").split("/")[-1].split("#")[0])
+        assert sorted(decklists[name]) == sorted(expected), name
+
+    min_gap = {}
+    for platform_name in ["moxfield", "archidekt", "tappedout"]:
+        times = sorted(t for p, t in server.log if p == platform_name)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        min_gap[platform_name] = min(gaps)
+        assert min_gap[platform_name] >= delay, platform_name
+
+    sequential = len(deck_urls) * (delay + latency)
+
+    print(f"{len(deck_urls)} decks on {len(PLATFORMS)} platforms, "
+          f"{delay}s delay, {latency}s latency")
+    print(f"crawl: {elapsed:.2f}s, sequential estimate: {sequential:.2f}s")
+    print(f"offline replay: {replay_elapsed:.2f}s")
+    for platform_name, gap in min_gap.items():
+        print(f"  {platform_name:10} min gap between requests {gap:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares memory footprint and build/scoring time of the dense pandas
+dataframe against the sparse incidence matrix.
+
+Run from the repository root:
+    python -m benchmarks.incidence_vs_dataframe
+"""
+
+import time
+
+import numpy as np
+
+from analyze import (
+    load_normalized, dataset_summary, create_dataframe, create_incidence,
+    card_vocabulary, not_basic_land
+)
+
+
+def timed(func, repeat=5):
+    """
+    Returns result of func and its best wall clock time in milliseconds
+    """
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return result, 1000 * best
+
+
+def main():
+    flat_dataset = load_normalized()
+    all_cards, num_decks = dataset_summary(flat_dataset)
+    deck_names = tuple(sorted(flat_dataset))
+    card_ids = card_vocabulary(sorted(all_cards))
+    nonbasic = np.array([not_basic_land(card) for card in sorted(all_cards)])
+
+    df, df_build = timed(lambda: create_dataframe(flat_dataset, all_cards))
+    mat, mat_build = timed(
+        lambda: create_incidence(flat_dataset, deck_names, card_ids)
+    )
+
+    df_bytes = df.memory_usage(deep=True).sum()
+    mat_bytes = mat.data.nbytes + mat.indices.nbytes + mat.indptr.nbytes
+    density = mat.nnz / (mat.shape[0] * mat.shape[1])
+
+    decklist = set(flat_dataset[deck_names[0]])
+    df_vec = np.array([1 if c in decklist else 0 for c in df.columns])
+    mat_vec = np.zeros(mat.shape[1], dtype=np.int32)
+    mat_vec[[card_ids[c] for c in decklist]] = 1
+    mat_vec[~nonbasic] = 0
+    deck_sizes = mat @ nonbasic.astype(np.int32)
+
+    def df_scores():
+        return [
+            sum(df_vec & df.loc[deck].values) /
+            sum(df_vec | df.loc[deck].values)
+            for deck in deck_names
+        ]
+
+    def mat_scores():
+        common = mat @ mat_vec
+        return common / (mat_vec.sum() + deck_sizes - common)
+
+    df_result, df_score = timed(df_scores, repeat=1)
+    mat_result, mat_score = timed(mat_scores)
+    assert np.allclose(df_result, mat_result)
+
+    print(f"{num_decks} decks x {len(all_cards)} cards, "
+          f"density {100 * density:.2f}%\n")
+    print(f"{'':22}{'dataframe':>14}{'incidence':>14}")
+    print(f"{'memory (KiB)':22}{df_bytes / 1024:>14.1f}"
+          f"{mat_bytes / 1024:>14.1f}")
+    print(f"{'build (ms)':22}{df_build:>14.2f}{mat_build:>14.2f}")
+    print(f"{'score all decks (ms)':22}{df_score:>14.2f}{mat_score:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""
+Load tests the Flask endpoints under gunicorn. A corpus of request
+payloads is built from ddb decklists the way the page sends them, and
+replayed by concurrent simulated users against a locally started server
+for every worker count, worker class and result cache size of the
+sweep.
+
+Every server runs two scenarios in turn. The analysis scenario mixes
+the analysis endpoints, which are bound by server CPU, so it shows how
+capacity scales with workers. The fetch scenario only sends /fetch,
+which is bound by platform latency; mixed into the same closed loop it
+would hold every user for most of the run. /fetch is pointed at the
+local platform stub instead of the real platforms, and every fetch asks
+for a deck url never sent before so that no fetch job is reused.
+
+With a cache size of 0 every analysis is computed. With the cache on,
+the share of /recommend and /compare answers served from it is reported
+as the hit ratio: a cached answer has no similarity stage in its
+Server-Timing header.
+
+Every simulated user sends its own X-Forwarded-For address, which the
+server trusts as one proxy hop, so rate limits apply per user as they
+would behind the platform router. The analysis rate limit is raised
+for the run unless RATE_LIMITED is set, and answers with 429 are
+reported apart from errors.
+
+Results are appended to benchmarks/results/load_test.jsonl together
+with the current commit and the settings of the run.
+
+Run from the repository root, optionally with the worker counts to run:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test 1 2
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import itertools
+import tempfile
+import threading
+import importlib.util
+import subprocess
+
+import numpy as np
+import requests
+
+from analyze import get_snapshot, load_lite
+from benchmarks.analysis import commit
+from benchmarks.stub_platforms import start_stub, stub_environment
+
+
+WORKER_COUNTS = [1, 2, 4]
+
+# Worker class and threads per worker. Async classes are skipped when
+# their library is not installed
+WORKER_CLASSES = [("sync", 1), ("gthread", 4), ("gevent", 1)]
+
+# Result cache sizes, 0 turns the cache off
+CACHE_SIZES = [0, 512]
+
+# Endpoints whose answers come from the result cache
+CACHED_ENDPOINTS = ("recommend", "compare")
+
+# Relative share of every endpoint in the traffic of each scenario
+SCENARIOS = {
+    "analysis": {"recommend": 4, "compare": 2, "generate_core": 2},
+    "fetch": {"fetch": 1}
+}
+
+CORPUS_SIZE = 400
+USERS = 8
+DURATION = 20
+STUB_LATENCY = 0.2
+RATE_LIMITED = bool(os.environ.get("RATE_LIMITED"))
+
+# Upper bounds of the latency histogram buckets in milliseconds
+BUCKETS = [5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")]
+
+STARTUP_TIMEOUT = 120
+FETCH_TIMEOUT = 30
+FETCH_POLL = 0.05
+
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), "results",
+                            "load_test.jsonl")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def misspell(card_name, rng):
+    """
+    Swaps two neighbouring letters, like a hand typed card name
+    """
+
+    if len(card_name) < 4:
+        return card_name
+
+    i = rng.randrange(1, len(card_name) - 2)
+    return card_name[:i] + card_name[i + 1] + card_name[i] + card_name[i + 2:]
+
+
+def build_corpus(snapshot, stub, mix, size=CORPUS_SIZE, seed=0):
+    """
+    Returns list of (endpoint, payload) pairs drawn from ddb decks in
+    the proportions of mix
+    """
+
+    rng = random.Random(seed)
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    full_names = list(snapshot.full_names)
+    corpus = []
+
+    for i in range(size):
+        endpoint = rng.choices(endpoints, weights)[0]
+        deck_id = rng.randrange(snapshot.num_decks)
+        deck = snapshot.deck_names[deck_id]
+        identity = list(snapshot.deck_colors[deck_id].upper())
+
+        # Decks in progress: part of a ddb list, sometimes with a typo
+        cards = list(snapshot.raw_flat_dataset[deck])
+        cards = rng.sample(cards, rng.randint(len(cards) // 2, len(cards)))
+        if rng.random() < 0.2:
+            j = rng.randrange(len(cards))
+            cards[j] = misspell(cards[j], rng)
+        decklist = "\n".join(f"1 {card}" for card in cards)
+
+        if endpoint == "recommend":
+            excluded = rng.sample(full_names, rng.choice([0, 0, 3, 10]))
+            payload = {
+                "decklist": decklist,
+                "excludelist": "\n".join(excluded),
+                "identity": identity
+            }
+        elif endpoint == "compare":
+            payload = {"decklist": decklist, "identity": identity}
+        elif endpoint == "generate_core":
+            payload = {
+                "identity": identity,
+                "ratio": rng.choice(["", "0.5", "0.6", "0.9"])
+            }
+        else:
+            platform_name = rng.choice(["moxfield", "archidekt", "tappedout"])
+            # Completed with a sequence number when sent
+            payload = {"url": stub.deck_url(platform_name, "load{sequence}")}
+
+        corpus.append((endpoint, payload))
+
+    return corpus
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, worker_class, threads, environment):
+    """
+    Starts gunicorn on a free local port and waits until it answers.
+    Returns the process and its base url
+    """
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "app:app",
+            "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers),
+            "--worker-class", worker_class,
+            "--threads", str(threads),
+            "--log-level", "warning"
+        ],
+        cwd=REPO_ROOT,
+        env=environment,
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            requests.get(base_url, timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    stop_server(process)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def send(session, base_url, endpoint, payload):
+    """
+    Sends one request and returns its outcome (ok, rate_limited or
+    error) and whether the answer came from the result cache, None for
+    endpoints without cache. A fetch counts until its job has finished
+    """
+
+    response = session.post(f"{base_url}/{endpoint}", json=payload,
+                            timeout=FETCH_TIMEOUT)
+
+    if response.status_code == 429:
+        return "rate_limited", None
+    if endpoint in CACHED_ENDPOINTS and response.status_code == 200:
+        timing = response.headers.get("Server-Timing", "")
+        return "ok", "similarity;" not in timing
+    if endpoint != "fetch":
+        return "ok" if response.status_code == 200 else "error", None
+    if response.status_code not in (200, 202):
+        return "error", None
+
+    job = response.json()
+    job_url = f"{base_url}/fetch/{job['job_id']}"
+    deadline = time.monotonic() + FETCH_TIMEOUT
+
+    while job["status"] == "pending" and time.monotonic() < deadline:
+        time.sleep(FETCH_POLL)
+        job = session.get(job_url, timeout=FETCH_TIMEOUT).json()
+
+    return "ok" if job["status"] == "done" else "error", None
+
+
+def replay(base_url, corpus, users=USERS, duration=DURATION):
+    """
+    Replays corpus in order with users concurrent closed loop clients
+    for duration seconds. Returns list of (endpoint, latency in ms,
+    outcome, cached) and the elapsed seconds
+    """
+
+    samples = []
+    lock = threading.Lock()
+    position = [0]
+    deadline = time.monotonic() + duration
+
+    def user(number):
+        session = requests.Session()
+        session.headers["X-Forwarded-For"] = (
+            f"10.0.{number // 256}.{number % 256}"
+        )
+
+        while time.monotonic() < deadline:
+            with lock:
+                sequence = position[0]
+                endpoint, payload = corpus[sequence % len(corpus)]
+                position[0] += 1
+
+            if endpoint == "fetch":
+                payload = {"url": payload["url"].format(sequence=sequence)}
+
+            start = time.perf_counter()
+            try:
+                outcome, cached = send(session, base_url, endpoint, payload)
+            except (requests.RequestException, ValueError, KeyError):
+                outcome, cached = "error", None
+            latency = 1000 * (time.perf_counter() - start)
+
+            with lock:
+                samples.append((endpoint, latency, outcome, cached))
+
+    start = time.monotonic()
+    clients = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    return samples, time.monotonic() - start
+
+
+def histogram(latencies):
+    """
+    Returns request count of every latency bucket
+    """
+
+    indexes = np.searchsorted(BUCKETS, latencies, side="left")
+    return np.bincount(indexes, minlength=len(BUCKETS)).tolist()
+
+
+def summarize(samples, elapsed, mix):
+    """
+    Returns latency percentiles, throughput, error and rate limit shares,
+    cache hit ratio and histogram of every endpoint and of all requests
+    together
+    """
+
+    stats = {}
+
+    for endpoint in list(mix) + ["all"]:
+        picked = [s for s in samples if endpoint in ("all", s[0])]
+        if not picked:
+            continue
+
+        latencies = np.array([s[1] for s in picked])
+        outcomes = [s[2] for s in picked]
+        cached = [s[3] for s in picked if s[3] is not None]
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+
+        stats[endpoint] = {
+            "requests": len(picked),
+            "throughput": len(picked) / elapsed,
+            "p50": p50,
+            "p90": p90,
+            "p99": p99,
+            "max": latencies.max(),
+            "errors": outcomes.count("error") / len(picked),
+            "rate_limited": outcomes.count("rate_limited") / len(picked),
+            "cache_hits": sum(cached) / len(cached) if cached else None,
+            "histogram": histogram(latencies)
+        }
+
+    return stats
+
+
+def report(record):
+    print(f"\n{record['scenario']}: {record['workers']} x "
+          f"{record['worker_class']} ({record['threads']} threads), "
+          f"{record['users']} users, cache size {record['cache_size']}")
+    print(f"{'':15}{'req':>6}{'req/s':>8}{'p50':>9}{'p90':>9}{'p99':>9}"
+          f"{'max':>9}{'err':>7}{'429':>7}{'hit':>7}")
+
+    for endpoint, s in record["stats"].items():
+        hits = "" if s["cache_hits"] is None else (
+            f"{100 * s['cache_hits']:.1f}%"
+        )
+        print(f"{endpoint:15}{s['requests']:>6}{s['throughput']:>8.1f}"
+              f"{s['p50']:>9.1f}{s['p90']:>9.1f}{s['p99']:>9.1f}"
+              f"{s['max']:>9.1f}{100 * s['errors']:>6.1f}%"
+              f"{100 * s['rate_limited']:>6.1f}%{hits:>7}")
+
+    counts = record["stats"]["all"]["histogram"]
+    scale = 50 / max(counts)
+
+    for bound, count in zip(BUCKETS, counts):
+        label = "inf" if bound == float("inf") else f"{bound:g}"
+        print(f"  <= {label:>5} ms {count:>6} {'#' * int(count * scale)}")
+
+
+def available(worker_class):
+    return worker_class in ("sync", "gthread") or (
+        importlib.util.find_spec(worker_class) is not None
+    )
+
+
+def main(worker_counts=WORKER_COUNTS, users=USERS, duration=DURATION):
+    cards = [c["full_name"] for c in load_lite().values()]
+    stub = start_stub(cards, latency=STUB_LATENCY)
+    corpora = {
+        scenario: build_corpus(get_snapshot(), stub, mix)
+        for scenario, mix in SCENARIOS.items()
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+
+    for worker_class, threads in WORKER_CLASSES:
+        if not available(worker_class):
+            print(f"\nskipping {worker_class}: not installed")
+            continue
+
+        for workers, cache_size in itertools.product(worker_counts,
+                                                     CACHE_SIZES):
+            runs = []
+
+            with tempfile.TemporaryDirectory() as directory:
+                environment = dict(
+                    os.environ,
+                    **stub_environment(stub),
+                    WEB_CONCURRENCY=str(workers),
+                    PROXY_HOPS="1",
+                    RESULT_CACHE_SIZE=str(cache_size),
+                    RATE_LIMIT_FILE=os.path.join(directory, "ratelimit.db"),
+                    FETCH_JOB_FILE=os.path.join(directory, "jobs.db")
+                )
+                if not RATE_LIMITED:
+                    environment.update(ANALYSIS_RATE="1000000",
+                                       ANALYSIS_BURST="1000000")
+
+                process, base_url = start_server(
+                    workers, worker_class, threads, environment
+                )
+                try:
+                    for scenario, corpus in corpora.items():
+                        runs.append((scenario, *replay(base_url, corpus,
+                                                       users, duration)))
+                finally:
+                    stop_server(process)
+
+            for scenario, samples, elapsed in runs:
+                record = {
+                    "scenario": scenario,
+                    "workers": workers,
+                    "worker_class": worker_class,
+                    "threads": threads,
+                    "users": users,
+                    "duration": elapsed,
+                    "cache_size": cache_size,
+                    "rate_limited": RATE_LIMITED,
+                    # None when the app default applies
+                    "analysis_rate": environment.get("ANALYSIS_RATE"),
+                    "analysis_burst": environment.get("ANALYSIS_BURST"),
+                    "corpus_size": len(corpora[scenario]),
+                    "stub_latency": STUB_LATENCY,
+                    # Server and simulated users share these
+                    "cpus": os.cpu_count(),
+                    "stats": summarize(samples, elapsed,
+                                       SCENARIOS[scenario]),
+                    "commit": commit(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+                }
+                report(record)
+
+                with open(RESULTS_FILE, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    stub.shutdown()
+    stub.server_close()
+
+
+if __name__ == "__main__":
+    main([int(workers) for workers in sys.argv[1:]] or WORKER_COUNTS)
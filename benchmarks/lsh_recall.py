@@ -0,0 +1,111 @@
+"""
+Measures recall and latency of the MinHash/LSH nearest deck search
+against the exact scan, on the ddb and on a larger corpus made of
+mutated ddb decks, for several signature and band configurations.
+
+Run from the repository root:
+    python -m benchmarks.lsh_recall
+"""
+
+import time
+
+import numpy as np
+
+from scipy import sparse
+
+from analyze import get_snapshot
+from lsh import MinHashIndex
+
+
+CONFIGS = [(64, 16), (128, 32), (192, 64), (256, 64), (128, 64)]
+
+
+def mutate(rows, num_cards, swap, random):
+    """
+    Returns sparse binary matrix of given card id rows with a swap
+    fraction of every row replaced by random cards
+    """
+
+    mutated = []
+
+    for cards in rows:
+        cards = set(cards)
+        for card in random.choice(
+            sorted(cards), int(swap * len(cards)), replace=False
+        ):
+            cards.discard(card)
+            cards.add(random.randint(num_cards))
+        mutated.append(sorted(cards))
+
+    indptr = np.cumsum([0] + [len(cards) for cards in mutated])
+    indices = np.concatenate(mutated)
+
+    return sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(mutated), num_cards)
+    )
+
+
+def exact_nearest(incidence, deck_sizes, vec, k):
+    common = incidence @ vec
+    scores = common / (vec.sum() + deck_sizes - common)
+    return np.argsort(-scores, kind="stable")[:k]
+
+
+def measure(incidence, queries, k=10):
+    deck_sizes = np.asarray(incidence.sum(axis=1)).ravel()
+    exact, exact_time = [], time.perf_counter()
+
+    for vec in queries:
+        exact.append(set(exact_nearest(incidence, deck_sizes, vec, k)))
+
+    exact_time = 1000 * (time.perf_counter() - exact_time) / len(queries)
+    print(f"  exact scan{'':27}{exact_time:>10.3f} ms/query")
+
+    for num_perm, bands in CONFIGS:
+        start = time.perf_counter()
+        index = MinHashIndex(incidence, num_perm, bands)
+        build = time.perf_counter() - start
+
+        recall, candidates, start = 0, 0, time.perf_counter()
+
+        for vec, truth in zip(queries, exact):
+            ids, _ = index.nearest(vec, k)
+            recall += len(truth & set(ids)) / k
+            candidates += len(index.candidates(vec))
+
+        elapsed = 1000 * (time.perf_counter() - start) / len(queries)
+        print(f"  {num_perm:>3} perms {bands:>2} bands  "
+              f"recall@{k} {recall / len(queries):.3f}  "
+              f"{candidates / len(queries):>8.1f} cands "
+              f"{elapsed:>8.3f} ms/query  (build {build:.2f} s)")
+
+
+def main(corpus_size=20000, num_queries=100, seed=0):
+    random = np.random.RandomState(seed)
+    snapshot = get_snapshot()
+
+    incidence = snapshot.minhash.incidence
+    num_cards = incidence.shape[1]
+    rows = np.split(incidence.indices, incidence.indptr[1:-1])
+
+    def queries_from(matrix):
+        picks = random.randint(matrix.shape[0], size=num_queries)
+        picked = [matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+                  for i in picks]
+        mutated = mutate(picked, num_cards, 0.1, random)
+        return [mutated[i].toarray().ravel() for i in range(num_queries)]
+
+    print(f"ddb: {incidence.shape[0]} decks")
+    measure(sparse.csr_matrix(incidence, dtype=np.int32),
+            queries_from(incidence))
+
+    picks = random.randint(len(rows), size=corpus_size)
+    corpus = mutate([rows[i] for i in picks], num_cards, 0.3, random)
+
+    print(f"\nmutated corpus: {corpus_size} decks")
+    measure(corpus, queries_from(corpus))
+
+
+if __name__ == "__main__":
+    main()
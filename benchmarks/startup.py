@@ -0,0 +1,221 @@
+"""
+Measures cold start and memory of the app under gunicorn: import time
+of app.py in a fresh interpreter and the heavy modules it pulls in,
+seconds from launching gunicorn until the app reports ready, and RSS,
+PSS and USS of the master and every worker, idle and after a burst of
+requests. PSS and USS show how much memory the forked workers share.
+
+Results are appended to benchmarks/results/startup.jsonl together with
+the commit of the measured checkout.
+
+Run from the repository root, optionally against another checkout:
+    python -m benchmarks.startup
+    python -m benchmarks.startup /path/to/other/checkout
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+import requests
+
+from analyze import get_snapshot
+from benchmarks.analysis import REPO_ROOT, commit
+from benchmarks.load_test import free_port, stop_server
+
+
+WORKERS = 4
+BURST = 40
+STARTUP_TIMEOUT = 120
+HEAVY_MODULES = ["pandas", "sklearn", "bs4", "requests"]
+
+# Checkouts without a readiness endpoint are ready once they serve /
+READY_PATHS = ["/ready", "/"]
+
+IMPORT_COMMAND = (
+    "import sys, time, json; start = time.perf_counter(); import app; "
+    "print(json.dumps({'seconds': time.perf_counter() - start, "
+    "'modules': [m for m in %r if m in sys.modules]}))" % HEAVY_MODULES
+)
+
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), "results",
+                            "startup.jsonl")
+
+
+def memory(pid):
+    """
+    Returns RSS, PSS and USS of a process in MiB
+    """
+
+    fields = {}
+
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"]
+    }
+
+
+def workers_of(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def process_memory(master):
+    """
+    Returns memory of the master and every worker, with totals
+    """
+
+    workers = [memory(pid) for pid in workers_of(master)]
+
+    return {
+        "master": memory(master),
+        "workers": workers,
+        "total_pss": memory(master)["pss"] + sum(w["pss"] for w in workers)
+    }
+
+
+def wait_ready(process, base_url):
+    """
+    Polls the readiness endpoint until it answers 200. Returns seconds
+    since the process was started
+    """
+
+    start = time.monotonic()
+    paths = list(READY_PATHS)
+
+    while time.monotonic() - start < STARTUP_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            response = requests.get(base_url + paths[0], timeout=1)
+            if response.status_code == 404 and len(paths) > 1:
+                paths.pop(0)
+            elif response.status_code == 200:
+                return time.monotonic() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+
+    raise RuntimeError("app did not become ready in time")
+
+
+def burst(base_url, count=BURST):
+    """
+    Sends /recommend requests for different ddb decks, every one from
+    its own client address so rate limits do not apply
+    """
+
+    snapshot = get_snapshot()
+
+    for i in range(count):
+        deck_id = i % snapshot.num_decks
+        deck = snapshot.deck_names[deck_id]
+        requests.post(
+            f"{base_url}/recommend",
+            json={
+                "decklist": "\n".join(
+                    f"1 {card}" for card in snapshot.raw_flat_dataset[deck]
+                ),
+                "excludelist": "",
+                "identity": list(snapshot.deck_colors[deck_id].upper())
+            },
+            headers={"X-Forwarded-For": f"10.1.{i // 256}.{i % 256}"},
+            timeout=60
+        )
+
+
+def measure(checkout, workers=WORKERS):
+    imported = json.loads(subprocess.run(
+        [sys.executable, "-c", IMPORT_COMMAND],
+        cwd=checkout, check=True, stdout=subprocess.PIPE
+    ).stdout.decode().strip().splitlines()[-1])
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "app:app",
+                "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers),
+                "--log-level", "warning"
+            ],
+            cwd=checkout,
+            env=dict(
+                os.environ,
+                WEB_CONCURRENCY=str(workers),
+                PROXY_HOPS="1",
+                RATE_LIMIT_FILE=os.path.join(directory, "ratelimit.db"),
+                FETCH_JOB_FILE=os.path.join(directory, "jobs.db")
+            ),
+            stdout=subprocess.DEVNULL
+        )
+
+        try:
+            ready = wait_ready(process, base_url)
+            # Let every worker finish booting before reading memory
+            time.sleep(2)
+            idle = process_memory(process.pid)
+            burst(base_url)
+            loaded = process_memory(process.pid)
+        finally:
+            stop_server(process)
+
+    return {
+        "import_seconds": imported["seconds"],
+        "imported_modules": imported["modules"],
+        "ready_seconds": ready,
+        "idle": idle,
+        "after_burst": loaded
+    }
+
+
+def report(record):
+    modules = ", ".join(record["imported_modules"]) or "no heavy modules"
+
+    print(f"\n{record['commit']}: {record['workers']} workers")
+    print(f"  import app    {record['import_seconds']:.3f} s ({modules})")
+    print(f"  ready after   {record['ready_seconds']:.3f} s")
+    print(f"  {'MiB':12}{'master rss':>12}{'worker rss':>12}"
+          f"{'worker pss':>12}{'worker uss':>12}{'total pss':>12}")
+
+    for state in ("idle", "after_burst"):
+        usage = record[state]
+        workers = usage["workers"]
+
+        def average(key):
+            return sum(w[key] for w in workers) / len(workers)
+
+        print(f"  {state:12}{usage['master']['rss']:>12.1f}"
+              f"{average('rss'):>12.1f}{average('pss'):>12.1f}"
+              f"{average('uss'):>12.1f}{usage['total_pss']:>12.1f}")
+
+
+def main(checkout=REPO_ROOT, workers=WORKERS):
+    record = dict(
+        measure(checkout, workers),
+        workers=workers,
+        commit=commit(checkout),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S")
+    )
+    report(record)
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+
+    with open(RESULTS_FILE, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,157 @@
+"""
+Local stand-in for the decklist platforms, so that scraping can be
+exercised without touching the real sites.
+
+Serves moxfield and archidekt style json APIs and tappedout style html
+pages with deterministic decklists. Deck urls are built with deck_url,
+and scraper.MOXFIELD_API / scraper.ARCHIDEKT_API have to be pointed at
+the stub via use_stub, or via the environment from stub_environment in
+processes started later.
+"""
+
+import json
+import time
+import random
+import hashlib
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubPlatforms(ThreadingHTTPServer):
+    """
+    Threaded http server answering like the decklist platforms. Keeps
+    a log of (platform, timestamp) for every request it served
+    """
+
+    daemon_threads = True
+
+    def __init__(self, cards, latency=0.0, deck_size=99, port=0):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.cards = list(cards)
+        self.latency = latency
+        self.deck_size = deck_size
+        self.revisions = {}
+        self.log = []
+        self.log_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def decklist(self, deck_id):
+        """
+        Returns deterministic decklist for given deck id. Bumping
+        revisions[deck_id] changes the decklist
+        """
+
+        rng = random.Random(f"{deck_id}:{self.revisions.get(deck_id, 0)}")
+        return rng.sample(self.cards, min(self.deck_size, len(self.cards)))
+
+    def deck_url(self, platform_name, deck_id):
+        """
+        Returns url of given deck as it would appear on the ddb
+        """
+
+        if platform_name == "moxfield":
+            return f"{self.base_url}/moxfield.com/decks/{deck_id}/"
+        if platform_name == "archidekt":
+            return f"{self.base_url}/archidekt.com/decks/{deck_id}#deck"
+        return f"{self.base_url}/tappedout.net/mtg-decks/{deck_id}/"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        parts = self.path.strip("/").split("/")
+
+        with server.log_lock:
+            server.log.append((parts[0].split(".")[0], time.monotonic()))
+
+        time.sleep(server.latency)
+
+        if parts[0] == "moxfield":
+            cards = server.decklist(parts[-1])
+            self.reply("application/json", json.dumps({
+                "mainboard": {c: {"quantity": 1} for c in cards[1:]},
+                "commanders": {cards[0]: {"quantity": 1}}
+            }))
+        elif parts[0] == "archidekt":
+            cards = server.decklist(parts[-2])
+            self.reply("application/json", json.dumps({"cards": [
+                {
+                    "category": "Main",
+                    "quantity": 1,
+                    "card": {"oracleCard": {"name": c}}
+                }
+                for c in cards
+            ]}))
+        elif parts[0] == "tappedout.net":
+            cards = server.decklist(parts[-1])
+            members = "".join(
+                f'<div class="member" id="boardContainer-main-{i}">'
+                f'<span class="qty board" data-qty="1"></span>'
+                f'<a class="card-link" data-name="{c}"></a></div>'
+                for i, c in enumerate(cards)
+            )
+            self.reply(
+                "text/html",
+                f'<html><div class="boardlist">{members}</div></html>'
+            )
+        else:
+            self.send_error(404)
+
+    def reply(self, content_type, body):
+        data = body.encode("utf-8")
+        etag = f'"{hashlib.sha1(data).hexdigest()}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub(cards, latency=0.0):
+    """
+    Starts stub server on a free local port in a background thread
+    """
+
+    server = StubPlatforms(cards, latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def stub_environment(server):
+    """
+    Returns environment variables pointing the scraper's platform APIs
+    at the stub server
+    """
+
+    return {
+        "MOXFIELD_API": f"{server.base_url}/moxfield/v2/decks/all/",
+        "ARCHIDEKT_API": f"{server.base_url}/archidekt/api/decks/"
+    }
+
+
+def use_stub(server):
+    """
+    Points the scraper's platform APIs at the stub server
+    """
+
+    import scraper
+
+    for name, value in stub_environment(server).items():
+        setattr(scraper, name, value)
@@ -0,0 +1,191 @@
+"""
+Generates synthetic ddbs in the shape of the json files in json_data,
+scaled to a multiple of the real deck count.
+
+Card popularity follows the real ddb: real cards keep their real deck
+counts as sampling weights and the extra cards needed by larger ddbs
+get a Zipf tail below the least played real card. Every archetype has a
+core of cards most of its decks play, so decks cluster like real ones.
+
+Write a 10x ddb into a directory with json_data/ inside:
+    python -m benchmarks.synthetic_ddb 10 /tmp/ddb10
+"""
+
+import os
+import sys
+import json
+
+import numpy as np
+
+from analyze import (
+    BASIC_LANDS, COLORS, load_database, load_lite, flatten, normalize,
+    summary, color_mask
+)
+
+
+BASIC_FOR_COLOR = {
+    "W": "Plains", "U": "Island", "B": "Swamp", "R": "Mountain",
+    "G": "Forest"
+}
+CORE_SIZE = 75
+CORE_RATE = 0.9
+ZIPF_EXPONENT = 1.1
+
+
+def synthetic_cards(lite, count, random):
+    """
+    Returns count new cards copying color identity, type and mana value
+    of random real cards
+    """
+
+    templates = [c for c in lite.values() if normalize(c["full_name"])
+                 not in BASIC_LANDS]
+    cards = {}
+
+    for i in range(count):
+        template = templates[random.randint(len(templates))]
+        full_name = f"Synthetic Card {i}"
+        cards[normalize(full_name)] = dict(template, full_name=full_name)
+
+    return cards
+
+
+def card_weights(lite, all_cards):
+    """
+    Returns sampling weight of every card: its real deck count, or a
+    Zipf tail below the least played real card for unplayed cards
+    """
+
+    played = {normalize(card): count for card, count in all_cards.items()}
+    floor = min(played.values())
+    unplayed = [c for c in lite if c not in played]
+
+    weights = {c: played[c] for c in lite if c in played}
+
+    for rank, card in enumerate(unplayed, start=1):
+        weights[card] = floor / (1 + rank) ** ZIPF_EXPONENT
+
+    return weights
+
+
+def generate(scale=1, seed=0):
+    """
+    Generates synthetic ddb with scale times the real deck count.
+    Returns deck database and lite scryfall dictionary
+    """
+
+    random = np.random.RandomState(seed)
+    database = load_database()
+    lite = {c: v for c, v in load_lite().items()}
+    all_cards, num_decks = summary(database)
+
+    # Vocabulary grows with the square root of the deck count
+    extra = int(len(lite) * (np.sqrt(scale) - 1))
+    lite.update(synthetic_cards(lite, extra, random))
+
+    for color, basic in BASIC_FOR_COLOR.items():
+        lite.setdefault(normalize(basic), {
+            "color_identity": [color],
+            "type_line": f"Basic Land — {basic}",
+            "cmc": 0.0,
+            "full_name": basic
+        })
+
+    weights = card_weights(lite, all_cards)
+    names = [c for c in lite if c not in BASIC_LANDS]
+    masks = np.array([color_mask(lite[c]["color_identity"]) for c in names])
+    popularity = np.array([weights[c] for c in names])
+
+    color_codes = list(database)
+    color_counts = np.array([
+        sum(len(database[c][t]) for t in database[c]) for c in color_codes
+    ])
+
+    basics = {
+        c: [
+            sum(normalize(card) in BASIC_LANDS for card in deck)
+            for deck_type in database[c].values()
+            for deck in deck_type.values()
+        ]
+        for c in color_codes
+    }
+
+    legal_cards = {}
+
+    for color in color_codes:
+        legal = np.flatnonzero((masks & ~color_mask(color)) == 0)
+        legal_cards[color] = (
+            legal, popularity[legal] / popularity[legal].sum()
+        )
+
+    synthetic = {}
+    cores = {}
+
+    for i in range(scale * num_decks):
+        color = color_codes[random.choice(
+            len(color_codes), p=color_counts / color_counts.sum()
+        )]
+        real_types = list(database[color])
+        num_types = int(len(real_types) * np.sqrt(scale))
+        type_id = random.randint(num_types)
+
+        if type_id < len(real_types):
+            deck_type = real_types[type_id]
+        else:
+            deck_type = f"Synthetic {color.upper()} Archetype {type_id}"
+
+        legal, p = legal_cards[color]
+
+        if (color, deck_type) not in cores:
+            cores[(color, deck_type)] = random.choice(
+                legal, min(CORE_SIZE, len(legal)), replace=False, p=p
+            )
+
+        core = cores[(color, deck_type)]
+        basic_names = [
+            BASIC_FOR_COLOR[x] for x in COLORS if x.lower() in color
+        ]
+        num_basics = basics[color][random.randint(len(basics[color]))]
+        deck = set(core[random.rand(len(core)) < CORE_RATE])
+
+        while len(deck) < 100 - num_basics:
+            deck.update(random.choice(
+                legal, 100 - num_basics - len(deck), replace=False, p=p
+            ))
+
+        decklist = [lite[names[j]]["full_name"] for j in sorted(deck)]
+        decklist += [
+            basic_names[j % len(basic_names)] for j in range(num_basics)
+        ]
+
+        deck_name = f"{deck_type} #{i}"
+        synthetic.setdefault(color, {}).setdefault(deck_type, {})
+        synthetic[color][deck_type][deck_name] = decklist
+
+    return synthetic, lite
+
+
+def write(directory, database, lite):
+    """
+    Writes synthetic ddb as the json files analyze expects under
+    directory/json_data
+    """
+
+    os.makedirs(os.path.join(directory, "json_data"), exist_ok=True)
+
+    normalized = {
+        deck: [normalize(card) for card in decklist]
+        for deck, decklist in flatten(database).items()
+    }
+
+    for filename, data in [
+        ("cedh_decklists.json", database),
+        ("normalized_decklists.json", normalized),
+        ("lite_scryfall_dict.json", lite)
+    ]:
+        with open(os.path.join(directory, "json_data", filename), "w") as f:
+            json.dump(data, f)
+
+
+if __name__ == "__main__":
+    write(sys.argv[2], *generate(int(sys.argv[1])))
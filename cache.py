@@ -0,0 +1,103 @@
+import time
+import json
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+
+def cache_key(kind, decklist, identity, excludelist=(), land_mode=False):
+    """
+    Computes canonical hash of a request. Card order, duplicates and
+    color order do not change the key
+    """
+
+    canonical = json.dumps([
+        kind,
+        sorted(set(decklist)),
+        sorted(set(c.upper() for c in identity)),
+        sorted(set(excludelist)),
+        bool(land_mode)
+    ])
+
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of rendered results bounded by number of
+    entries and entry age. Entries belong to a snapshot version and the
+    whole cache is dropped as soon as a different version is seen
+    """
+
+    def __init__(self, maxsize=512, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        """
+        Returns cached result or None on a miss
+        """
+
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, version, key, result):
+        """
+        Stores result, evicting least recently used entries if full
+        """
+
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, version, key, compute):
+        """
+        Returns cached result, calling compute() and storing its
+        result on a miss
+        """
+
+        result = self.get(version, key)
+
+        if result is None:
+            result = compute()
+            self.put(version, key, result)
+
+        return result
+
+    def stats(self):
+        """
+        Returns hit/miss counters and current size
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "version": self.version
+            }
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
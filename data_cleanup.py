@@ -1,7 +1,8 @@
 import json
 
 from analyze import (
-    normalize, flatten, load_database, load_scryfall, load_lite, summary
+    normalize, flatten, load_database, load_scryfall, load_lite, summary,
+    compile_snapshot, write_binary
 )
 
 
@@ -37,6 +38,16 @@ def normalized_decklists():
         json.dump(normalized_decks, f)
 
 
+def binary_snapshot():
+    """
+    Compiles json files into the memory-mappable binary snapshot.
+    Has to be rerun whenever any of the json files change
+    """
+
+    header, arrays = compile_snapshot()
+    write_binary(header, arrays)
+
+
 def fix_land_color_identity():
     scry = load_scryfall(filename="json_data/scryfall_card_dictionary.json")
     scry_lite = load_lite(filename="json_data/lite_scryfall_dict.json")
@@ -125,6 +136,9 @@ if __name__ == "__main__":
     print("Normalized decklists DONE")
 
     fix_land_color_identity()
+
+    binary_snapshot()
+    print("Binary snapshot DONE")
     """
     #######################################################################
 
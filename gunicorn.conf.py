@@ -0,0 +1,30 @@
+import gc
+
+# Import the app and warm it up in the master, then fork workers that
+# share the snapshot and its tables copy-on-write
+preload_app = True
+
+# No collections in the master: freed objects would leave holes in
+# shared pages that workers later fill, copying those pages
+gc.disable()
+
+
+def when_ready(server):
+    import app
+
+    app.warm_up()
+
+    # Collections in the workers skip frozen objects, so scanning them
+    # does not copy their pages either
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+
+def post_worker_init(worker):
+    import app
+
+    if not app.warm.is_set():
+        app.start_warm_up()
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlite_conn import SqliteConn
+
+
+class FetchJobs:
+    """
+    Runs decklist fetches on a background thread pool. Job state lives
+    in a local sqlite file, so any gunicorn worker can answer a poll and
+    a URL that is in flight or was fetched recently is only fetched once
+    """
+
+    def __init__(self, run, filename=None, max_workers=4, ttl=300,
+                 timeout=60):
+        self.run = run
+        self.filename = filename or os.path.join(
+            tempfile.gettempdir(), "cedh_fetch_jobs.db"
+        )
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._db = SqliteConn(self.filename)
+
+        with self._db.get() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, "
+                "url TEXT, status TEXT, result TEXT, created REAL, "
+                "finished REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_url ON jobs (url)")
+
+    def _pool(self):
+        # Created on first use so that threads are never started before
+        # gunicorn forks its workers
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+        return self._executor
+
+    def submit(self, url):
+        """
+        Returns id of a job fetching given url, reusing a pending job or
+        one that finished within ttl seconds
+        """
+
+        now = time.time()
+        db = self._db.get()
+
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT id FROM jobs WHERE url = ? AND ("
+                "(status = 'pending' AND created > ?) OR "
+                "(status = 'done' AND finished > ?)"
+                ") ORDER BY created DESC LIMIT 1",
+                (url, now - self.timeout, now - self.ttl)
+            ).fetchone()
+
+            if row:
+                return row[0]
+
+            job_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO jobs VALUES (?, ?, 'pending', NULL, ?, NULL)",
+                (job_id, url, now)
+            )
+            db.execute(
+                "DELETE FROM jobs WHERE created < ?",
+                (now - max(self.ttl, self.timeout) * 10,)
+            )
+
+        self._pool().submit(self._execute, job_id, url)
+
+        return job_id
+
+    def _execute(self, job_id, url):
+        try:
+            status, result = "done", self.run(url)
+        except Exception as e:
+            status, result = "failed", {"error": str(e)}
+
+        with self._db.get() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ? "
+                "WHERE id = ?",
+                (status, json.dumps(result), time.time(), job_id)
+            )
+
+    def status(self, job_id):
+        """
+        Returns job status with its result once finished, or None if
+        job id is unknown
+        """
+
+        row = self._db.get().execute(
+            "SELECT status, result, created FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        status, result, created = row
+
+        if status == "pending" and time.time() - created > self.timeout:
+            return {"status": "failed", "error": "Fetch timed out"}
+
+        return dict(json.loads(result or "{}"), status=status)
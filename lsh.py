@@ -0,0 +1,148 @@
+import numpy as np
+
+from scipy import sparse
+
+
+MERSENNE_PRIME = (1 << 31) - 1
+EMPTY_SLOT = np.iinfo(np.uint32).max
+
+# Rows of the incidence matrix hashed per block when building signatures
+SIGNATURE_BLOCK = 1024
+
+
+class MinHashIndex:
+    """
+    MinHash signatures of every deck with LSH banding over them. Finds
+    candidate nearest decks of a decklist in time proportional to the
+    number of colliding decks instead of the size of the corpus, then
+    ranks only those candidates by exact Jaccard similarity.
+
+    num_perm hash functions are split into bands of num_perm // bands
+    rows. More bands with fewer rows raise recall and candidate counts,
+    fewer bands with more rows lower both
+    """
+
+    def __init__(self, incidence, num_perm=128, bands=32, seed=0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+
+        self.incidence = sparse.csr_matrix(incidence, dtype=np.int32)
+        self.deck_sizes = np.asarray(self.incidence.sum(axis=1)).ravel()
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        random = np.random.RandomState(seed)
+        a = random.randint(1, MERSENNE_PRIME, size=num_perm)
+        b = random.randint(0, MERSENNE_PRIME, size=num_perm)
+        card_ids = np.arange(self.incidence.shape[1], dtype=np.int64)
+
+        # One row of num_perm hash values per card id, plus a padding row
+        # that never wins the minimum
+        self.hashes = np.vstack([
+            (np.outer(card_ids, a) + b) % MERSENNE_PRIME,
+            np.full((1, num_perm), EMPTY_SLOT)
+        ]).astype(np.uint32)
+
+        # Band number goes into the top bits of every bucket key so all
+        # bands share a single sorted key array
+        self.band_shift = np.uint64(64 - max(1, (bands - 1).bit_length()))
+
+        # Odd multipliers folding the rows of each band into one key
+        self.mixers = random.randint(
+            0, 1 << 62, size=(bands, self.rows), dtype=np.int64
+        ).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+
+        self.signatures = self.deck_signatures()
+        self.keys, self.decks = self.band_buckets()
+
+    def deck_signatures(self):
+        """
+        Computes MinHash signature of every row of the incidence matrix,
+        a block of rows at a time to bound memory. Rows are padded to
+        equal length so the minimum is a single vectorized reduction
+        """
+
+        num_decks, num_cards = self.incidence.shape
+        signatures = np.empty((num_decks, self.num_perm), dtype=np.uint32)
+
+        for start in range(0, num_decks, SIGNATURE_BLOCK):
+            block = self.incidence[start:start + SIGNATURE_BLOCK]
+            lengths = np.diff(block.indptr)
+            width = max(1, lengths.max())
+
+            padded = np.full((block.shape[0], width), num_cards)
+            positions = np.arange(width) < lengths[:, np.newaxis]
+            padded[positions] = block.indices
+
+            signatures[start:start + block.shape[0]] = (
+                self.hashes[padded].min(axis=1)
+            )
+
+        return signatures
+
+    def band_keys(self, signatures):
+        """
+        Folds signatures into one 64 bit bucket key per band
+        """
+
+        bands = signatures.reshape(-1, self.bands, self.rows)
+        keys = (bands.astype(np.uint64) * self.mixers).sum(axis=2)
+        band_ids = np.arange(self.bands, dtype=np.uint64)
+
+        keys &= (np.uint64(1) << self.band_shift) - np.uint64(1)
+        keys |= band_ids << self.band_shift
+
+        return keys
+
+    def band_buckets(self):
+        """
+        Sorts bucket keys of every deck and band so that decks sharing a
+        bucket are found by binary search. Decks without cards are left
+        out
+        """
+
+        filled = np.flatnonzero(self.signatures[:, 0] != EMPTY_SLOT)
+        keys = self.band_keys(self.signatures[filled]).ravel()
+        order = np.argsort(keys, kind="stable")
+
+        return keys[order], np.repeat(filled, self.bands)[order]
+
+    def candidates(self, decklist_vec):
+        """
+        Returns ids of decks sharing at least one band with given
+        decklist vector
+        """
+
+        card_ids = np.flatnonzero(decklist_vec)
+
+        if not len(card_ids):
+            return np.array([], dtype=np.int64)
+
+        keys = self.band_keys(self.hashes[card_ids].min(axis=0))[0]
+        lo = np.searchsorted(self.keys, keys, side="left")
+        lengths = np.searchsorted(self.keys, keys, side="right") - lo
+
+        offsets = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+        found = self.decks[np.arange(lengths.sum()) + offsets]
+
+        return np.unique(found)
+
+    def nearest(self, decklist_vec, k=50):
+        """
+        Returns ids and exact Jaccard similarities of the k most similar
+        candidate decks, most similar first
+        """
+
+        ids = self.candidates(decklist_vec)
+
+        if not len(ids):
+            return ids, np.array([])
+
+        common = self.incidence[ids] @ decklist_vec
+        union = int(decklist_vec.sum()) + self.deck_sizes[ids] - common
+        scores = common / union
+
+        order = np.argsort(-scores, kind="stable")[:k]
+
+        return ids[order], scores[order]
@@ -0,0 +1,249 @@
+import time
+import threading
+
+from contextlib import contextmanager
+
+
+# Upper bounds of latency histogram buckets in seconds
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+_local = threading.local()
+
+
+def format_value(value):
+    """
+    Formats number the way the Prometheus text format expects
+    """
+
+    value = float(value)
+
+    if value == float("inf"):
+        return "+Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels):
+    """
+    Formats label pairs as {name="value",...}, escaping values
+    """
+
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """
+    Monotonic counter per combination of label values
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield self.name, zip(self.labels, key), value
+
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count per combination of label
+    values
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            counts, _, _ = entry = self._values[key]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            }
+
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = list(zip(self.labels, key))
+            cumulative = 0
+
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (f"{self.name}_bucket",
+                       labels + [("le", format_value(bound))], cumulative)
+
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Callback:
+    """
+    Metric read from application state when rendered. The callback
+    returns a number, or a list of (labels dict, number) pairs
+    """
+
+    def __init__(self, name, help_text, kind, callback):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+
+        if not isinstance(values, list):
+            values = [({}, values)]
+
+        for labels, value in values:
+            yield self.name, sorted(labels.items()), value
+
+
+class Registry:
+    """
+    Metrics of this process rendered in the Prometheus text format.
+    Every gunicorn worker keeps its own registry, so a scrape reports
+    the worker that answered it
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, labels=()):
+        self.metrics.append(Counter(name, help_text, labels))
+        return self.metrics[-1]
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.metrics.append(Histogram(name, help_text, labels, buckets))
+        return self.metrics[-1]
+
+    def callback(self, name, help_text, kind, callback):
+        self.metrics.append(Callback(name, help_text, kind, callback))
+        return self.metrics[-1]
+
+    def render(self):
+        lines = []
+
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+            for name, labels, value in metric.samples():
+                lines.append(
+                    f"{name}{format_labels(list(labels))} "
+                    f"{format_value(value)}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "cedh_stage_seconds",
+    "Time spent in each stage of request handling and analysis",
+    labels=("stage",)
+)
+
+
+def begin_request():
+    """
+    Starts collecting stage timings of the current request
+    """
+
+    _local.timings = []
+
+
+def end_request():
+    """
+    Stops collecting and returns (stage, seconds) pairs of the current
+    request in the order the stages finished
+    """
+
+    timings = getattr(_local, "timings", None) or []
+    _local.timings = None
+
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block into the stage histogram and, inside a
+    request, into the timings of that request
+    """
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = getattr(_local, "timings", None)
+
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def server_timing(timings):
+    """
+    Formats stage timings as a Server-Timing header value, adding up
+    repeated stages
+    """
+
+    totals = {}
+
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0) + elapsed
+
+    return ", ".join(
+        f"{name};dur={1000 * elapsed:.3f}" for name, elapsed in totals.items()
+    )
@@ -0,0 +1,186 @@
+import io
+import os
+import sys
+import hmac
+import time
+import pstats
+import random
+import cProfile
+import threading
+
+from flask import g
+from flask import request
+from flask import Response
+
+
+PROFILE_HEADER = "X-Profile"
+MODE_HEADER = "X-Profile-Mode"
+INLINE_HEADER = "X-Profile-Inline"
+
+# Seconds between two stack samples of the profiled request
+SAMPLE_INTERVAL = 0.0001
+
+# Functions listed in inline pstats reports
+REPORT_LINES = 40
+
+# Samplers running in this process and the switch interval to restore
+# once the last of them stops
+_switch_lock = threading.Lock()
+_active_samplers = 0
+_saved_switch_interval = None
+
+
+class Sampler:
+    """
+    Samples the stack of one thread at a fixed interval from a
+    background thread and counts identical stacks. Unlike cProfile it
+    does not slow down the profiled code in proportion to its calls
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        global _active_samplers, _saved_switch_interval
+
+        # The profiled thread only hands over the GIL every switch
+        # interval, which would otherwise cap the sampling rate. The
+        # interval is process-wide, so it is lowered by the first
+        # running sampler and restored by the last
+        with _switch_lock:
+            if _active_samplers == 0:
+                _saved_switch_interval = sys.getswitchinterval()
+            _active_samplers += 1
+            sys.setswitchinterval(
+                min(sys.getswitchinterval(), self.interval)
+            )
+
+        self._thread.start()
+
+    def stop(self):
+        global _active_samplers
+
+        self._stopped.set()
+        self._thread.join()
+
+        with _switch_lock:
+            _active_samplers -= 1
+            if _active_samplers == 0:
+                sys.setswitchinterval(_saved_switch_interval)
+
+    def _run(self):
+        # Jittered intervals keep samples from locking onto a loop
+        # that runs at the sampling period
+        while not self._stopped.wait(self.interval * random.uniform(0.5, 1.5)):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                )
+                frame = frame.f_back
+
+            if stack:
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def collapsed(self):
+        """
+        Returns samples as collapsed stacks, one "root;...;leaf count"
+        line per distinct stack, as read by flamegraph tools
+        """
+
+        return "".join(
+            f"{stack} {count}\n"
+            for stack, count in sorted(self.counts.items())
+        )
+
+
+def start_profile(mode):
+    """
+    Starts a deterministic (pstats) or sampling (collapsed) profiler on
+    the current thread
+    """
+
+    if mode == "collapsed":
+        profiler = Sampler(threading.get_ident())
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    return profiler
+
+
+def finish_profile(profiler, directory, name):
+    """
+    Stops profiler and writes its output into directory. Returns file
+    name and a text rendering of the profile
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    if isinstance(profiler, Sampler):
+        profiler.stop()
+        text = profiler.collapsed()
+        filename = os.path.join(directory, f"{name}.collapsed")
+
+        with open(filename, "w") as f:
+            f.write(text)
+
+        return filename, text
+
+    profiler.disable()
+    filename = os.path.join(directory, f"{name}.pstats")
+    profiler.dump_stats(filename)
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+
+    return filename, report.getvalue()
+
+
+def install(app, secret, directory):
+    """
+    Profiles requests carrying the secret in the X-Profile header.
+    X-Profile-Mode picks pstats (cProfile, default) or collapsed
+    (stack sampling) output, written into directory. With
+    X-Profile-Inline set the profile replaces the response body.
+    Nothing is registered without a secret, so unprofiled requests
+    cost nothing
+    """
+
+    if not secret:
+        return
+
+    @app.before_request
+    def start_request_profile():
+        token = request.headers.get(PROFILE_HEADER)
+
+        if token and hmac.compare_digest(token.encode(), secret.encode()):
+            g.profiler = start_profile(request.headers.get(MODE_HEADER))
+
+    @app.after_request
+    def finish_request_profile(response):
+        profiler = g.pop("profiler", None)
+
+        if profiler is None:
+            return response
+
+        endpoint = request.endpoint or "unknown"
+        name = f"{endpoint}-{os.getpid()}-{time.time_ns()}"
+        filename, text = finish_profile(profiler, directory, name)
+
+        if request.headers.get(INLINE_HEADER):
+            response = Response(text, status=200, mimetype="text/plain")
+
+        response.headers["X-Profile-File"] = os.path.basename(filename)
+
+        return response
@@ -0,0 +1,198 @@
+import os
+import math
+import time
+import tempfile
+import threading
+
+from functools import wraps
+
+from flask import request
+from flask import Response
+
+from sqlite_conn import SqliteConn
+
+
+# Seconds between two sweeps removing buckets that have refilled. A full
+# bucket behaves exactly like a missing one, so dropping it is free
+SWEEP_INTERVAL = 60
+
+
+def refill(tokens, updated, now, rate, burst):
+    """
+    Returns number of tokens in a bucket after refilling it at given
+    rate (tokens per second) up to burst size
+    """
+
+    return min(burst, tokens + (now - updated) * rate)
+
+
+def reserve(tokens, rate):
+    """
+    Returns tokens left and seconds to wait for the next token, 0 if a
+    token was available and taken
+    """
+
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+def full_at(tokens, now, rate, burst):
+    """
+    Returns time at which a bucket holding tokens is full again
+    """
+
+    return now + (burst - tokens) / rate
+
+
+class MemoryStore:
+    """
+    Token buckets kept in process memory. Only correct while a single
+    worker serves all requests
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._swept = 0
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """
+        Takes one token from bucket under key. Returns seconds until the
+        next token, 0 if a token was available
+        """
+
+        with self._lock:
+            if now - self._swept > SWEEP_INTERVAL:
+                self._buckets = {
+                    k: bucket for k, bucket in self._buckets.items()
+                    if bucket[2] > now
+                }
+                self._swept = now
+
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+            tokens, wait = reserve(tokens, rate)
+            self._buckets[key] = (
+                tokens, now, full_at(tokens, now, rate, burst)
+            )
+
+        return wait
+
+
+class FileStore:
+    """
+    Token buckets kept in a local sqlite file so that all gunicorn
+    workers on the machine share the same counters
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._swept = 0
+        self._db = SqliteConn(self.filename)
+
+        with self._db.get() as db:
+            columns = [
+                row[1] for row in db.execute("PRAGMA table_info(buckets)")
+            ]
+
+            # Buckets only live for seconds, so a table from before
+            # eviction is dropped rather than migrated
+            if columns and "full" not in columns:
+                db.execute("DROP TABLE buckets")
+
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, "
+                "tokens REAL, updated REAL, full REAL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS buckets_full ON buckets (full)"
+            )
+
+    def take(self, key, rate, burst, now):
+        """
+        Takes one token from bucket under key. Returns seconds until the
+        next token, 0 if a token was available
+        """
+
+        db = self._db.get()
+
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+
+            if now - self._swept > SWEEP_INTERVAL:
+                db.execute("DELETE FROM buckets WHERE full <= ?", (now,))
+                self._swept = now
+
+            row = db.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, updated = row or (burst, now)
+            tokens = refill(tokens, updated, now, rate, burst)
+            tokens, wait = reserve(tokens, rate)
+
+            db.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+                (key, tokens, now, full_at(tokens, now, rate, burst))
+            )
+
+        return wait
+
+
+def default_store():
+    """
+    Picks shared file store when RATE_LIMIT_FILE is set, under gunicorn
+    or when several workers are configured, in-memory store otherwise.
+    The worker count given to gunicorn on the command line is not
+    visible to the app, so gunicorn always gets the file store
+    """
+
+    filename = os.environ.get("RATE_LIMIT_FILE")
+    shared = (
+        os.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn")
+        or int(os.environ.get("WEB_CONCURRENCY", 1)) > 1
+    )
+
+    if not filename and shared:
+        filename = os.path.join(tempfile.gettempdir(), "cedh_ratelimit.db")
+
+    if filename:
+        return FileStore(filename)
+    return MemoryStore()
+
+
+def client_address():
+    """
+    Returns client IP. Forwarded addresses only count when the app is
+    wrapped in ProxyFix with the number of trusted proxies
+    """
+
+    return request.remote_addr or "unknown"
+
+
+def rate_limit(store, rate, burst):
+    """
+    Route decorator enforcing a token bucket per client and route.
+    Clients over quota are rejected right away with 429 and told when
+    to retry, so they never hold a worker while waiting
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def limited_view(*args, **kwargs):
+            key = f"{request.endpoint}:{client_address()}"
+            wait = store.take(key, rate, burst, time.time())
+
+            if wait:
+                return Response(
+                    "Too many requests! Please wait a moment and try again.",
+                    status=429,
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))},
+                    mimetype="application/json"
+                )
+
+            return view(*args, **kwargs)
+
+        return limited_view
+
+    return decorator
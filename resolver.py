@@ -0,0 +1,133 @@
+import threading
+
+from collections import Counter
+
+from analyze import normalize, load_lite
+
+
+def trigrams(name):
+    """
+    Returns set of character trigrams of a padded name
+    """
+
+    padded = f"  {name} "
+
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CardResolver:
+    """
+    Resolves pasted card names to normalized card names. Exact matches
+    are a single dictionary lookup; misses fall back to a trigram index
+    and pick the most similar known name above threshold
+    """
+
+    def __init__(self, full_names, threshold=0.5):
+        self.full_names = full_names
+        self.names = list(full_names)
+        self.threshold = threshold
+        self.index = {}
+        self.sizes = []
+
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.index.setdefault(gram, []).append(i)
+
+    def fuzzy(self, card):
+        """
+        Returns most similar known card name by trigram dice
+        coefficient, or None if nothing is similar enough
+        """
+
+        grams = trigrams(card)
+        shared = Counter()
+
+        for gram in grams:
+            shared.update(self.index.get(gram, ()))
+
+        best, best_score = None, self.threshold
+
+        for i, count in shared.items():
+            score = 2 * count / (len(grams) + self.sizes[i])
+            if score > best_score:
+                best, best_score = self.names[i], score
+
+        return best
+
+    def resolve(self, card_name):
+        """
+        Returns normalized name of given card, or None if unknown
+        """
+
+        card = normalize(card_name.strip())
+
+        if card in self.full_names:
+            return card
+
+        return self.fuzzy(card)
+
+    def resolve_all(self, card_names):
+        """
+        Resolves list of card names. Returns resolved names in input
+        order, dictionary of corrected inputs to full card names and
+        list of names that could not be resolved
+        """
+
+        resolved = []
+        corrected = {}
+        unresolved = []
+
+        for card_name in card_names:
+            card = self.resolve(card_name)
+
+            if card is None:
+                unresolved.append(card_name)
+                continue
+
+            if card != normalize(card_name.strip()):
+                corrected[card_name] = self.full_names[card]
+
+            resolved.append(card)
+
+        return resolved, corrected, unresolved
+
+
+def resolution_report(corrected, unresolved):
+    """
+    Formats corrected and unresolved card names for display above
+    analysis results
+    """
+
+    output = ""
+
+    for card_name, full_name in corrected.items():
+        output += f"Corrected: {card_name} -> {full_name}\n"
+
+    for card_name in unresolved:
+        output += f"Unknown card (ignored): {card_name}\n"
+
+    return output + "\n" if output else output
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    """
+    Returns the process-wide resolver, building it on first access
+    """
+
+    global _resolver
+
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                lite = load_lite()
+                _resolver = CardResolver({
+                    card: lite[card]["full_name"] for card in lite
+                })
+
+    return _resolver
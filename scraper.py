@@ -2,12 +2,171 @@ import requests
 import json
 import time
 import re
+import os
+import hashlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 
 
 HEADERS = {'user-agent': 'Mozilla/5.0'}
 
+REQUEST_TIMEOUT = 10
+POOL_SIZE = 8
+
+# Seconds between two decklist scrapes on the same platform
+HOST_DELAY = 3
+HOST_DELAYS = {}
+
+MOXFIELD_API = os.environ.get(
+    "MOXFIELD_API", "https://api.moxfield.com/v2/decks/all/"
+)
+ARCHIDEKT_API = os.environ.get(
+    "ARCHIDEKT_API", "https://archidekt.com/api/decks/"
+)
+
+MANIFEST_FILE = "scrape_manifest.json"
+
+# Disk cache of platform responses. Modes:
+#   off    - always use the network
+#   cache  - serve responses younger than HTTP_CACHE_MAX_AGE seconds
+#   record - always use the network and record every response
+#   replay - only serve recorded responses, never use the network
+HTTP_CACHE_DIR = os.environ.get("SCRAPER_CACHE_DIR", "http_cache")
+HTTP_CACHE_MODE = os.environ.get("SCRAPER_CACHE_MODE", "off")
+HTTP_CACHE_MAX_AGE = float(os.environ.get("SCRAPER_CACHE_MAX_AGE", 86400))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session_for(url):
+    """
+    Returns keep-alive session shared by all requests to the host of
+    given url
+    """
+
+    host = urlparse(url).netloc
+
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+
+    return _sessions[host]
+
+
+def http_get(url, **kwargs):
+    """
+    Performs GET request through the pooled session of the url host,
+    going through the disk cache according to HTTP_CACHE_MODE
+    """
+
+    mode = HTTP_CACHE_MODE
+
+    if mode in ("cache", "replay"):
+        max_age = None if mode == "replay" else HTTP_CACHE_MAX_AGE
+        response = cached_response(url, max_age)
+
+        if response is not None:
+            return response
+        if mode == "replay":
+            raise LookupError(f"No recorded response for {url}")
+
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    response = session_for(url).get(url, **kwargs)
+
+    if mode in ("cache", "record") and response.status_code == 200:
+        record_response(url, response)
+
+    return response
+
+
+def cache_paths(url, content_hash=None):
+    """
+    Returns path of the cache index entry of given url and, if given,
+    of the content addressed body file
+    """
+
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    index_path = os.path.join(HTTP_CACHE_DIR, "index", key[:2], f"{key}.json")
+
+    if content_hash is None:
+        return index_path, None
+
+    body_path = os.path.join(
+        HTTP_CACHE_DIR, "objects", content_hash[:2], content_hash
+    )
+    return index_path, body_path
+
+
+def record_response(url, response):
+    """
+    Stores response body under its content hash and points the index
+    entry of url at it
+    """
+
+    content_hash = hashlib.sha1(response.content).hexdigest()
+    index_path, body_path = cache_paths(url, content_hash)
+
+    if not os.path.exists(body_path):
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        with open(f"{body_path}.tmp", "wb") as f:
+            f.write(response.content)
+        os.replace(f"{body_path}.tmp", body_path)
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    write_json_atomic(index_path, {
+        "url": url,
+        "status": response.status_code,
+        "headers": {
+            k: v for k, v in response.headers.items()
+            if k.lower() not in ("content-encoding", "content-length")
+        },
+        "encoding": response.encoding,
+        "hash": content_hash,
+        "fetched": time.time()
+    })
+
+
+def cached_response(url, max_age=None):
+    """
+    Returns recorded response of url, or None if there is none or it
+    is older than max_age seconds
+    """
+
+    index_path, _ = cache_paths(url)
+
+    try:
+        with open(index_path, "r") as f:
+            entry = json.loads(f.read())
+        _, body_path = cache_paths(url, entry["hash"])
+        with open(body_path, "rb") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+
+    if max_age is not None and time.time() - entry["fetched"] > max_age:
+        return None
+
+    response = requests.Response()
+    response._content = content
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = entry["encoding"]
+    response.url = url
+
+    return response
+
 
 def clean(url):
     """
@@ -27,8 +186,9 @@ def parse(url):
     """
 
     master_json = {}
+    deck_urls = {}
 
-    response = requests.get(url, headers=HEADERS)
+    response = http_get(url)
     soup = BeautifulSoup(response.text, features="html.parser")
 
     for i, p in enumerate(soup.select("#decks > li:not(.hidden)")):
@@ -39,12 +199,11 @@ def parse(url):
         # Extract deck type
         deck_type = parse_deck_type(p)
 
-        # Extract all decklists and add them to master json
+        # Collect all decklists, they are scraped concurrently below
         for deck_link in p.select(".ddb-decklists li a"):
 
             name = deck_link.text.strip()
-            print(f"Parsing deck: {name}")
-            decklist = parse_decklist_platform(clean(deck_link.get("href")))
+            deck_urls[name] = clean(deck_link.get("href"))
 
             if color not in master_json:
                 master_json[color] = {}
@@ -52,13 +211,212 @@ def parse(url):
             if deck_type not in master_json[color]:
                 master_json[color][deck_type] = {}
 
-            master_json[color][deck_type][name] = decklist
-            time.sleep(3)
+            master_json[color][deck_type][name] = []
+
+    decklists = crawl(deck_urls)
+
+    for color in master_json:
+        for deck_type in master_json[color]:
+            for name in master_json[color][deck_type]:
+                master_json[color][deck_type][name] = decklists.get(name, [])
 
     with open("cedh_decklists.json", "w") as f:
         json.dump(master_json, f)
 
 
+def platform_of(url):
+    """
+    Returns name of decklist platform hosting given url, or None
+    """
+
+    for platform_name in DECKLIST_PLATFORM_PARSERS:
+        if platform_name in url:
+            return platform_name
+
+    return None
+
+
+def crawl(deck_urls, max_workers=8, delays=None, scrape=None,
+          on_result=None):
+    """
+    Scrapes decklists concurrently. Decks on the same platform are
+    scraped one after another, spaced out by that platform's delay,
+    while different platforms proceed in parallel. Returns dictionary
+    of deck name to decklist; failed decks are left out.
+
+    scrape(name, url) replaces plain decklist parsing and on_result(name,
+    result) is called, one deck at a time, after every successful scrape
+    """
+
+    delays = dict(HOST_DELAYS, **(delays or {}))
+    scrape = scrape or (lambda name, url: parse_decklist_platform(url))
+    result_lock = threading.Lock()
+    queues = {}
+
+    for name, url in deck_urls.items():
+        queues.setdefault(platform_of(url), []).append(name)
+
+    decklists = {}
+
+    def scrape_platform(platform_name):
+        delay = delays.get(platform_name, HOST_DELAY)
+
+        for i, name in enumerate(queues[platform_name]):
+            if i:
+                time.sleep(delay)
+
+            try:
+                print(f"Parsing deck: {name}")
+                result = scrape(name, deck_urls[name])
+            except Exception as e:
+                print(f"Failed to parse deck {name}: {e!r}")
+                continue
+
+            with result_lock:
+                decklists[name] = result
+                if on_result:
+                    on_result(name, result)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        for future in [executor.submit(scrape_platform, p) for p in queues]:
+            future.result()
+
+    return decklists
+
+
+def write_json_atomic(filename, data):
+    """
+    Writes json file via temporary file and rename, so readers and
+    crashes never see a partially written file
+    """
+
+    tmp_filename = f"{filename}.tmp"
+
+    with open(tmp_filename, "w") as f:
+        json.dump(data, f)
+
+    os.replace(tmp_filename, filename)
+
+
+def load_manifest(filename=MANIFEST_FILE):
+    """
+    Loads scrape manifest: per deck url, content hash, http validators
+    and fetch time, plus the start and end time of the latest run
+    """
+
+    try:
+        with open(filename, "r") as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return {"decks": {}}
+
+
+def scrape_if_changed(url, entry):
+    """
+    Re-scrapes deck only if it changed since the manifest entry was
+    recorded, using a conditional request and a content hash. Returns
+    new manifest entry and decklist, or None if deck is unchanged
+    """
+
+    headers = {}
+
+    if entry.get("url") == url:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = http_get(primary_url(url), headers=headers)
+    new_entry = {
+        "url": url,
+        "hash": entry.get("hash"),
+        "etag": response.headers.get("ETag", entry.get("etag")),
+        "last_modified": response.headers.get(
+            "Last-Modified",
+            entry.get("last_modified")
+        ),
+        "fetched": time.time()
+    }
+
+    if response.status_code == 304:
+        return new_entry, None
+
+    response.raise_for_status()
+    new_entry["hash"] = hashlib.sha1(response.content).hexdigest()
+
+    if entry.get("url") == url and entry.get("hash") == new_entry["hash"]:
+        return new_entry, None
+
+    return new_entry, parse_decklist_platform(url, response=response)
+
+
+def refresh_via_dict(filename, manifest_file=MANIFEST_FILE,
+                     checkpoint_every=20):
+    """
+    Refreshes all decks of cedh_decklists.json found in the deck url
+    dictionary, re-parsing only decks that changed. Progress is
+    checkpointed every few decks and an interrupted run is resumed
+    """
+
+    with open(filename, "r") as f:
+        deck_urls = json.loads(f.read())
+
+    with open("cedh_decklists.json", "r") as g:
+        json_data = json.loads(g.read())
+
+    manifest = load_manifest(manifest_file)
+
+    if "run_started" not in manifest or manifest.get("run_finished"):
+        manifest["run_started"] = time.time()
+        manifest["run_finished"] = None
+    else:
+        print("Resuming interrupted refresh")
+
+    # Deck name -> deck type dictionary that holds its decklist
+    located = {}
+    for c in json_data:
+        for d in json_data[c]:
+            for x in json_data[c][d]:
+                located[x] = json_data[c][d]
+
+    pending = {}
+    for x in located:
+        entry = manifest["decks"].get(x, {})
+        if x not in deck_urls:
+            print(f"No url found for deck: {x}")
+        elif entry.get("fetched", 0) < manifest["run_started"]:
+            pending[x] = deck_urls[x]
+
+    progress = {"done": 0}
+
+    def checkpoint():
+        write_json_atomic("cedh_decklists.json", json_data)
+        write_json_atomic(manifest_file, manifest)
+
+    def scrape(name, url):
+        # Decks without a decklist are always scraped from scratch
+        entry = manifest["decks"].get(name, {}) if located[name][name] else {}
+        return scrape_if_changed(url, entry)
+
+    def on_result(name, result):
+        entry, decklist = result
+        manifest["decks"][name] = entry
+
+        if decklist is None:
+            print(f"Unchanged: {name}")
+        else:
+            located[name][name] = decklist
+
+        progress["done"] += 1
+        if progress["done"] % checkpoint_every == 0:
+            checkpoint()
+
+    crawl(pending, scrape=scrape, on_result=on_result)
+
+    manifest["run_finished"] = time.time()
+    checkpoint()
+
+
 def parse_color(element):
     """
     Extract commander color identity for given deck element.
@@ -93,28 +451,53 @@ def parse_deck_type(element):
     return element.get('data-title')
 
 
-def parse_decklist_platform(url, wait_time=0):
+def parse_decklist_platform(url, wait_time=0, response=None):
     """
     Determines decklist platform and chooses decklist parsing accordingly.
+    An already fetched response of primary_url(url) can be passed in.
     """
 
     print(f"Attempting to parse: {url}")
 
-    for platform_name in DECKLIST_PLATFORM_PARSERS:
-        if platform_name in url:
-            decklist = DECKLIST_PLATFORM_PARSERS[platform_name](url)
-            time.sleep(wait_time)
-            return decklist
+    platform_name = platform_of(url)
+
+    if platform_name:
+        decklist = DECKLIST_PLATFORM_PARSERS[platform_name](url, response)
+        time.sleep(wait_time)
+        return decklist
 
     time.sleep(wait_time)
     print("No matching platform found! Returning empty decklist")
     return []
 
 
-def parse_moxfield(url):
+def primary_url(url):
+    """
+    Returns url that the platform parser fetches first for given deck
+    """
+
+    platform_name = platform_of(url)
+
+    if platform_name == "moxfield":
+        return moxfield_api_url(url)
+    if platform_name == "archidekt":
+        return archidekt_api_url(url)
+    return url
+
+
+def moxfield_api_url(url):
     deck_id = re.search(r"moxfield\.com\/decks\/([\w\-]+)\/?", url).group(1)
-    api_string = f"https://api.moxfield.com/v2/decks/all/{deck_id}"
-    response = requests.get(api_string, headers=HEADERS, timeout=5)
+    return f"{MOXFIELD_API}{deck_id}"
+
+
+def archidekt_api_url(url):
+    deck_id = re.search(r"archidekt\.com\/decks\/(\w+)\#", url).group(1)
+    return f"{ARCHIDEKT_API}{deck_id}/small/"
+
+
+def parse_moxfield(url, response=None):
+    if response is None:
+        response = http_get(moxfield_api_url(url), timeout=5)
     result = response.json()
     output_decklist = []
     for card in result["mainboard"]:
@@ -127,8 +510,9 @@ def parse_moxfield(url):
     return output_decklist
 
 
-def parse_tappedout(url):
-    response = requests.get(url, headers=HEADERS)
+def parse_tappedout(url, response=None):
+    if response is None:
+        response = http_get(url)
     soup = BeautifulSoup(response.text, features="html.parser")
     result = []
 
@@ -150,9 +534,8 @@ def parse_tappedout(url):
     for title in soup.select(".board-col h3"):
         if "commander" in title.text.lower():
             for commander_link in title.find_next_sibling().select("a"):
-                response = requests.get(
-                    f"https://tappedout.net{commander_link.get('href')}",
-                    headers=HEADERS
+                response = http_get(
+                    f"https://tappedout.net{commander_link.get('href')}"
                 )
                 commander_soup = BeautifulSoup(
                     response.text,
@@ -166,10 +549,9 @@ def parse_tappedout(url):
     return result
 
 
-def parse_archidekt(url):
-    deck_id = re.search(r"archidekt\.com\/decks\/(\w+)\#", url).group(1)
-    api_string = f"https://archidekt.com/api/decks/{deck_id}/small/"
-    response = requests.get(api_string, headers=HEADERS)
+def parse_archidekt(url, response=None):
+    if response is None:
+        response = http_get(archidekt_api_url(url))
     result = response.json()
 
     output_decklist = []
@@ -186,8 +568,9 @@ def parse_archidekt(url):
     return output_decklist
 
 
-def parse_scryfall(url):
-    response = requests.get(url, headers=HEADERS)
+def parse_scryfall(url, response=None):
+    if response is None:
+        response = http_get(url)
     soup = BeautifulSoup(response.text, features="html.parser")
     result = []
 
@@ -203,8 +586,9 @@ def parse_scryfall(url):
     return result
 
 
-def parse_deckbox(url):
-    response = requests.get(url, headers=HEADERS)
+def parse_deckbox(url, response=None):
+    if response is None:
+        response = http_get(url)
     deck_json = re.search(
         r"Tcg\.MtgDeck\({.+?}, ({.+})\);",
         response.text
@@ -221,7 +605,7 @@ def parse_deckbox(url):
 def safe_parse(url):
     deck_dict = {}
 
-    response = requests.get(url, headers=HEADERS)
+    response = http_get(url)
     soup = BeautifulSoup(response.text, features="html.parser")
 
     for p in soup.select("#decks > li:not(.hidden)"):
@@ -237,7 +621,7 @@ def safe_parse(url):
 
 def create_master_json(url):
     master_json = {}
-    response = requests.get(url, headers=HEADERS)
+    response = http_get(url)
     soup = BeautifulSoup(response.text, features="html.parser")
 
     for p in soup.select("#decks > li:not(.hidden)"):
@@ -266,21 +650,27 @@ def parse_via_dict(filename):
     with open("cedh_decklists.json", "r") as g:
         json_data = json.loads(g.read())
 
+    pending = {}
+
     for c in json_data:
         for d in json_data[c]:
             for x in json_data[c][d]:
 
                 if json_data[c][d][x]:
                     print("Already scraped !!")
+                elif x not in data:
+                    print(f"No url found for deck: {x}")
                 else:
-                    try:
-                        print(f"Have to scrape deck: {x}")
-                        decklist = parse_decklist_platform(data[x])
-                        json_data[c][d][x] = decklist
-                        time.sleep(3)
+                    print(f"Have to scrape deck: {x}")
+                    pending[x] = data[x]
 
-                    except Exception:
-                        print("Some exception occurred.")
+    decklists = crawl(pending)
+
+    for c in json_data:
+        for d in json_data[c]:
+            for x in json_data[c][d]:
+                if x in decklists:
+                    json_data[c][d][x] = decklists[x]
 
     with open("cedh_decklists.json", "w") as h:
         json.dump(json_data, h)
@@ -303,3 +693,4 @@ if __name__ == "__main__":
     # create_master_json(URL)
 
     parse_via_dict("deck_dict.json")
+    # refresh_via_dict("deck_dict.json")
@@ -0,0 +1,25 @@
+import os
+import sqlite3
+import threading
+
+
+class SqliteConn:
+    """
+    One sqlite connection per thread and process to a shared file.
+    Stores built at import time exist in the gunicorn master before
+    --preload forks the workers, so a connection opened in another
+    process is never reused
+    """
+
+    def __init__(self, filename, timeout=5):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self):
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.db = sqlite3.connect(
+                self.filename, timeout=self.timeout
+            )
+            self._local.pid = os.getpid()
+        return self._local.db